@@ -0,0 +1,37 @@
+"""
+Propagation of activity writes to the data derived from activities.
+"""
+from collections import namedtuple
+
+from .leaderboard import record_activities
+from .response_cache import bump_version
+from .rollups import record_stats
+from .totals import record_points
+
+# sign is 1 for an added activity and -1 for a removed one
+ActivityChange = namedtuple(
+    'ActivityChange',
+    ['user_id', 'points', 'created_at', 'sign', 'duration', 'distance', 'calories'],
+    defaults=[0, 0, 0],
+)
+
+
+def activity_change(activity, sign):
+    """Build the ``ActivityChange`` adding (1) or removing (-1) ``activity``"""
+    return ActivityChange(
+        activity.user_id, activity.points, activity.created_at, sign,
+        activity.duration, activity.distance, activity.calories,
+    )
+
+
+def activities_changed(changes, db=None):
+    """
+    Apply ``ActivityChange`` tuples to the materialized leaderboards, the
+    denormalized user and team totals and the daily stats rollups, and
+    invalidate cached responses that read activities.
+    """
+    changes = [ActivityChange(*change) for change in changes]
+    record_activities(changes, db=db)
+    record_points(changes, db=db)
+    record_stats(changes, db=db)
+    bump_version('activities')
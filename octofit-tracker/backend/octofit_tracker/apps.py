@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Listeners only attach to clients created after registration
+        from .mongo import install_monitoring
+        install_monitoring()
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_asgi_application()
+
+# Replay activities a crashed process left in the write-behind log
+from octofit_tracker.write_behind import get_buffer  # noqa: E402
+
+get_buffer()
@@ -0,0 +1,140 @@
+"""
+Async read endpoints for the user dashboard.
+
+Each lookup runs as its own blocking pymongo call in a worker thread, so
+independent lookups execute concurrently and a dashboard answers in about
+the time of its slowest query rather than the sum of all of them.
+
+``user_activities`` pages like ``/api/users/<pk>/activities/``, with the
+same ``KeysetPagination`` cursor and ``page_size``. The dashboard instead
+embeds a plain list of the ``limit`` latest activities.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from bson import ObjectId
+from django.http import JsonResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from .fast_serializers import rows_for
+from .indexes import NEWEST_FIRST
+from .leaderboard import PERIODS, get_rankings, ranking_rows
+from .models import Activity, User
+from .mongo import as_model, get_db
+from .pagination import KeysetPagination
+from .repository import activities_by_user
+from .serializers import ActivitySerializer, TeamSerializer, UserSerializer
+from .team_index import teams_for_member
+
+DEFAULT_ACTIVITY_LIMIT = 100
+MAX_ACTIVITY_LIMIT = 500
+
+
+def _in_thread(func):
+    """Run blocking ``func`` in the thread pool without serializing callers"""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+@_in_thread
+def load_user(pk):
+    if not ObjectId.is_valid(pk):
+        return None
+    document = get_db().users.find_one({'_id': ObjectId(pk)})
+    return UserSerializer(as_model(User, document)).data if document else None
+
+
+@_in_thread
+def load_activities(user_id, limit=DEFAULT_ACTIVITY_LIMIT):
+    documents = get_db().activities.find({'user_id': user_id}).sort(NEWEST_FIRST).limit(limit)
+    return ActivitySerializer([as_model(Activity, d) for d in documents], many=True).data
+
+
+@_in_thread
+def load_activity_page(request, user_id):
+    """The page of ``user_id``'s activities ``request`` asks for, as the sync action renders it"""
+    paginator = KeysetPagination()
+    rows = rows_for(ActivitySerializer())
+    ordering = {field.lstrip('-') for field in paginator.ordering}
+    page = paginator.paginate_queryset(
+        activities_by_user(user_id).values(*rows.columns | ordering), Request(request)
+    )
+    return paginator.get_paginated_response(rows.render(page)).data
+
+
+@_in_thread
+def load_teams(user_id):
+    return TeamSerializer(teams_for_member(user_id), many=True).data
+
+
+@_in_thread
+def load_leaderboard(period='all-time'):
+    return ranking_rows(get_rankings(period))
+
+
+def _json(data, status=200):
+    return JsonResponse(data, encoder=JSONEncoder, safe=False, status=status)
+
+
+def _not_found():
+    return _json({'detail': 'Not found.'}, status=404)
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_ACTIVITY_LIMIT))
+    except ValueError:
+        limit = DEFAULT_ACTIVITY_LIMIT
+    return max(1, min(limit, MAX_ACTIVITY_LIMIT))
+
+
+def _period(request):
+    period = request.GET.get('period', 'all-time')
+    return period if period in PERIODS else None
+
+
+async def user_detail(request, pk):
+    user = await load_user(pk)
+    return _json(user) if user else _not_found()
+
+
+async def user_activities(request, pk):
+    try:
+        user, activities = await asyncio.gather(load_user(pk), load_activity_page(request, pk))
+    except NotFound as error:
+        return _json({'detail': str(error.detail)}, status=404)
+    return _json(activities) if user else _not_found()
+
+
+async def user_teams(request, pk):
+    user, teams = await asyncio.gather(load_user(pk), load_teams(pk))
+    return _json(teams) if user else _not_found()
+
+
+async def leaderboard(request):
+    period = _period(request)
+    if period is None:
+        return _json({'error': f'period must be one of: {", ".join(PERIODS)}'}, status=400)
+    return _json(await load_leaderboard(period))
+
+
+async def user_dashboard(request, pk):
+    """The user, their latest activities, their teams and the leaderboard in one response"""
+    period = _period(request)
+    if period is None:
+        return _json({'error': f'period must be one of: {", ".join(PERIODS)}'}, status=400)
+    user, activities, teams, rankings = await asyncio.gather(
+        load_user(pk),
+        load_activities(pk, _limit(request)),
+        load_teams(pk),
+        load_leaderboard(period),
+    )
+    if not user:
+        return _not_found()
+    return _json({
+        'user': user,
+        'activities': activities,
+        'teams': teams,
+        'leaderboard': rankings,
+    })
@@ -0,0 +1,127 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+"""
+from contextlib import contextmanager
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from pymongo import monitoring
+
+from .mongo import new_client
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count the commands a MongoClient sends to the server"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def bench_client():
+    """Return a (client, counter) pair with command counting enabled"""
+    counter = CommandCounter()
+    client = new_client(event_listeners=[counter])
+    return client, counter
+
+
+def measure(func, repeat, counter=None):
+    """
+    Call ``func`` ``repeat`` times and summarise latency in milliseconds.
+
+    When a ``CommandCounter`` is given, the average number of commands per
+    call is reported as ``queries``.
+    """
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        before = counter.count if counter else 0
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+        if counter:
+            queries += counter.count - before
+    timings.sort()
+    return {
+        'runs': repeat,
+        'queries': queries / repeat if counter else None,
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+@contextmanager
+def use_database(name):
+    """Point the default djongo connection at database ``name`` for the duration"""
+    original = connection.settings_dict['NAME']
+    connection.close()
+    connection.settings_dict['NAME'] = name
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = original
+
+
+def peak_allocated_mb(func):
+    """
+    Call ``func`` once under tracemalloc and return the peak Python memory
+    it allocated, in MB above what was allocated when it started.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+    return round((peak - baseline) / 2 ** 20, 3)
+
+
+def compare_results(baseline, current, tolerance=0.2):
+    """
+    Compare two ``bench_endpoints`` reports.
+
+    Returns a message for every endpoint whose p95 latency grew by more than
+    ``tolerance`` (a fraction) or that now sends more queries.
+    """
+    regressions = []
+    for size, dataset in current.get('datasets', {}).items():
+        before = baseline.get('datasets', {}).get(size, {}).get('endpoints', {})
+        for endpoint, result in dataset['endpoints'].items():
+            old = before.get(endpoint)
+            if old is None:
+                continue
+            if result['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+                regressions.append(
+                    f'{size} {endpoint}: p95 {old["p95_ms"]}ms -> {result["p95_ms"]}ms'
+                )
+            if (result['queries'] or 0) > (old['queries'] or 0):
+                regressions.append(
+                    f'{size} {endpoint}: queries {old["queries"]} -> {result["queries"]}'
+                )
+    return regressions
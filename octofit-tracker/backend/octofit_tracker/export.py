@@ -0,0 +1,67 @@
+"""
+Streaming activity exports.
+
+Rows are read from a server-side MongoDB cursor in fixed-size batches and
+encoded one at a time, so memory use does not grow with the export size.
+"""
+import csv
+import json
+
+from .mongo import get_db
+
+EXPORT_FIELDS = [
+    'id', 'user_id', 'activity_type', 'duration', 'distance',
+    'calories', 'points', 'notes', 'created_at',
+]
+BATCH_SIZE = 1000
+
+
+class Echo:
+    """File-like object whose write() returns the value instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def activity_rows(user_id=None, start=None, end=None, db=None):
+    """Yield export rows for activities matching the filters, oldest first"""
+    query = {}
+    if user_id is not None:
+        query['user_id'] = user_id
+    if start is not None or end is not None:
+        query['created_at'] = {}
+        if start is not None:
+            query['created_at']['$gte'] = start
+        if end is not None:
+            query['created_at']['$lt'] = end
+
+    db = db if db is not None else get_db()
+    projection = {field: 1 for field in EXPORT_FIELDS if field != 'id'}
+    cursor = db.activities.find(query, projection, batch_size=BATCH_SIZE).sort('created_at', 1)
+    try:
+        for document in cursor:
+            row = {field: document.get(field) for field in EXPORT_FIELDS}
+            row['id'] = str(document['_id'])
+            if row['created_at'] is not None:
+                row['created_at'] = row['created_at'].isoformat()
+            yield row
+    finally:
+        cursor.close()
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(Echo(), fieldnames=EXPORT_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
@@ -0,0 +1,169 @@
+"""
+Compiled row renderers producing the same JSON as the serializers in
+``serializers``, for list endpoints.
+
+DRF resolves every field of every row through ``get_attribute`` and
+dispatches each ``SerializerMethodField`` by name. ``compile_rows`` does
+that lookup once per serializer class and field set and returns a
+``CompiledRows`` whose ``render`` turns raw documents (``QuerySet.values()``
+rows or pymongo documents) straight into output dicts. Only the columns in
+``CompiledRows.columns`` need to be loaded.
+
+Method fields are reimplemented in ``METHOD_FIELDS``; fields that need one
+lookup per page (``user_name``, ``team_name``) declare it in
+``BATCH_LOOKUPS``. The parity test in ``tests`` keeps both in line with the
+serializers.
+"""
+from datetime import timezone
+from functools import lru_cache
+from types import SimpleNamespace
+
+from django.conf import settings
+from rest_framework import ISO_8601, serializers as drf
+from rest_framework.settings import api_settings
+
+from .serializers import (
+    ActivitySerializer,
+    LeaderboardSerializer,
+    TeamSerializer,
+    UserSerializer,
+    WorkoutSerializer,
+    resolve_user_names,
+)
+from .team_index import team_names_by_member
+
+_missing = object()
+
+
+def _object_id(row, lookups):
+    return str(row['_id']) if row['_id'] else None
+
+
+def _user_name(row, lookups):
+    return lookups['user_name'].get(row['user_id'], 'Unknown User')
+
+
+def _team_name(row, lookups):
+    return lookups['team_name'].get(str(row['_id']))
+
+
+def _member_count(row, lookups):
+    member_ids = row['member_ids']
+    return len(member_ids) if member_ids and isinstance(member_ids, list) else 0
+
+
+def _workout_type(row, lookups):
+    level = row['difficulty_level']
+    return level.capitalize() if level else 'General'
+
+
+def _constant(value):
+    return lambda row, lookups: value
+
+
+# (serializer class, method field) -> function of (row, lookups)
+METHOD_FIELDS = {
+    (UserSerializer, 'id'): _object_id,
+    (UserSerializer, 'team_name'): _team_name,
+    (TeamSerializer, 'id'): _object_id,
+    (TeamSerializer, 'member_count'): _member_count,
+    (ActivitySerializer, 'id'): _object_id,
+    (ActivitySerializer, 'user_name'): _user_name,
+    (LeaderboardSerializer, 'id'): _object_id,
+    (LeaderboardSerializer, 'user_name'): _constant('User'),
+    (LeaderboardSerializer, 'total_points'): _constant(0),
+    (LeaderboardSerializer, 'total_activities'): _constant(0),
+    (WorkoutSerializer, 'id'): _object_id,
+    (WorkoutSerializer, 'workout_type'): _workout_type,
+}
+
+# (serializer class, method field) -> function mapping a page of rows to its lookup table
+BATCH_LOOKUPS = {
+    (UserSerializer, 'team_name'): lambda rows: team_names_by_member(str(row['_id']) for row in rows),
+    (ActivitySerializer, 'user_name'): lambda rows: resolve_user_names(row['user_id'] for row in rows),
+}
+
+# Field types whose to_representation is a plain conversion
+_CONVERTERS = {
+    drf.CharField: str,
+    drf.EmailField: str,
+    drf.IntegerField: int,
+    drf.FloatField: float,
+}
+
+
+def _utc_isoformat(value):
+    """DateTimeField.to_representation for ISO 8601 output in UTC"""
+    if isinstance(value, str):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat() + 'Z'
+
+
+def _converter(field, attname):
+    if isinstance(field, drf.JSONField) and not field.binary:
+        return None
+    if (type(field) is drf.DateTimeField and settings.USE_TZ and settings.TIME_ZONE == 'UTC'
+            and not hasattr(field, 'timezone')
+            and getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() == ISO_8601):
+        return _utc_isoformat
+    if isinstance(field, drf.ModelField):
+        # ModelField reads the value off the instance itself
+        return lambda value: field.to_representation(SimpleNamespace(**{attname: value}))
+    return _CONVERTERS.get(type(field), field.to_representation)
+
+
+def _value_getter(model, field):
+    model_field = model._meta.get_field(field.source)
+    attname = model_field.attname
+    convert = _converter(field, attname)
+
+    def get(row, lookups):
+        value = row.get(attname, _missing)
+        if value is _missing:
+            # Same fallback as mongo.as_model for documents without the field
+            value = model_field.get_default()
+        if value is None or convert is None:
+            return value
+        return convert(value)
+    return get
+
+
+class CompiledRows:
+    """Renderer for one serializer class and set of output fields"""
+
+    def __init__(self, serializer_class, field_names):
+        serializer = serializer_class()
+        model = serializer_class.Meta.model
+        self.getters = []
+        self.batch = []
+        self.columns = {model._meta.pk.attname}
+        sources = getattr(serializer_class.Meta, 'method_sources', {})
+        for name in field_names:
+            field = serializer.fields[name]
+            if isinstance(field, drf.SerializerMethodField):
+                self.getters.append((name, METHOD_FIELDS[(serializer_class, name)]))
+                self.columns.update(sources.get(name, ()))
+                if (serializer_class, name) in BATCH_LOOKUPS:
+                    self.batch.append((name, BATCH_LOOKUPS[(serializer_class, name)]))
+            else:
+                self.getters.append((name, _value_getter(model, field)))
+                self.columns.add(model._meta.get_field(field.source).attname)
+
+    def render(self, rows):
+        rows = list(rows)
+        lookups = {name: lookup(rows) for name, lookup in self.batch} if rows else {}
+        getters = self.getters
+        return [{name: get(row, lookups) for name, get in getters} for row in rows]
+
+
+@lru_cache(maxsize=None)
+def compile_rows(serializer_class, field_names):
+    """Return the cached ``CompiledRows`` for ``serializer_class`` and a tuple of fields"""
+    return CompiledRows(serializer_class, field_names)
+
+
+def rows_for(serializer):
+    """``CompiledRows`` for a (possibly ``?fields=`` trimmed) serializer instance"""
+    return compile_rows(type(serializer), tuple(serializer.fields))
@@ -0,0 +1,189 @@
+"""
+Idempotency-Key support for activity writes.
+
+Clients on flaky networks retry POSTs whose response they never saw. A
+request carrying an ``Idempotency-Key`` header runs once per key and path;
+retries get the original status and body back, marked with
+``Idempotent-Replayed: true``, without writing again.
+
+Completed responses are kept in a bounded per-process LRU
+(``settings.IDEMPOTENCY['MAX_ENTRIES']``, expiring after ``TTL`` seconds),
+so retries are usually answered from memory. Every key is also recorded in
+the ``idempotency_keys`` collection, which a TTL index empties after the
+same ``TTL``. The first request claims its key there with an insert, so
+retries that reach another process, or arrive while the first request is
+still running, are recognised as well. Reusing a key for a different
+request (another body or content type, compared byte for byte) is rejected
+with 422, and 5xx responses release the key so the client can retry.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from hashlib import sha1
+import json
+import threading
+import time
+
+from django.conf import settings
+from pymongo.errors import DuplicateKeyError
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .mongo import get_db
+
+MAX_KEY_LENGTH = 255
+
+# A claim this old belongs to a request that died before answering
+STALE_CLAIM = timedelta(seconds=60)
+
+
+class ResponseCache:
+    """Thread-safe LRU of completed responses with a time to live"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, record = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return record
+
+    def put(self, key, record):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = None
+
+
+def local_cache():
+    """The process's ``ResponseCache``, sized from ``settings.IDEMPOTENCY``"""
+    global _local
+    if _local is None:
+        _local = ResponseCache(settings.IDEMPOTENCY['MAX_ENTRIES'], settings.IDEMPOTENCY['TTL'])
+    return _local
+
+
+def claim(key, fingerprint, db=None):
+    """
+    Claim ``key`` for a new request. Returns None when the caller now owns
+    it, otherwise the existing record (``status`` is None while its request
+    is still running). A stale claim is only taken over by a retry of the
+    same request.
+    """
+    db = db if db is not None else get_db()
+    now = datetime.utcnow()
+    try:
+        db.idempotency_keys.insert_one({
+            '_id': key, 'fingerprint': fingerprint, 'status': None, 'data': None, 'created_at': now,
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    record = db.idempotency_keys.find_one({'_id': key})
+    if record is None:
+        # Expired since the insert failed
+        return claim(key, fingerprint, db)
+    if (record['status'] is None and record['fingerprint'] == fingerprint
+            and record['created_at'] < now - STALE_CLAIM):
+        taken = db.idempotency_keys.update_one(
+            {'_id': key, 'status': None, 'created_at': record['created_at']},
+            {'$set': {'created_at': now}},
+        )
+        if taken.modified_count:
+            return None
+    if record['status'] is not None:
+        local_cache().put(key, record)
+    return record
+
+
+def complete(key, fingerprint, response, db=None):
+    """Record the response to the request owning ``key`` and return the record"""
+    db = db if db is not None else get_db()
+    # Plain JSON types, like the response cache stores
+    data = json.loads(json.dumps(response.data, cls=JSONEncoder))
+    db.idempotency_keys.update_one({'_id': key}, {'$set': {'status': response.status_code, 'data': data}})
+    record = {'_id': key, 'fingerprint': fingerprint, 'status': response.status_code, 'data': data}
+    local_cache().put(key, record)
+    return record
+
+
+def release(key, db=None):
+    """Give up ``key`` after a failed request so a retry runs again"""
+    db = db if db is not None else get_db()
+    db.idempotency_keys.delete_one({'_id': key, 'status': None})
+
+
+def _replay(record, fingerprint):
+    if record['fingerprint'] != fingerprint:
+        return Response(
+            {'error': 'Idempotency-Key was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if record['status'] is None:
+        return Response(
+            {'error': 'A request with this Idempotency-Key is still in progress'},
+            status=status.HTTP_409_CONFLICT
+        )
+    return Response(record['data'], status=record['status'], headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(method):
+    """
+    Run the decorated viewset action once per ``Idempotency-Key`` header
+    and answer retries with the recorded response. Requests are told apart
+    by their raw body, so the action must not have read ``request.data``
+    before the decorator runs.
+    """
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if key is None:
+            return method(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        key = f'{request.path}:{key}'
+        # The raw body: parsed data need not be JSON serializable (msgpack)
+        fingerprint = sha1(request.content_type.encode() + b'\n' + request.body).hexdigest()
+
+        record = local_cache().get(key)
+        if record is None:
+            record = claim(key, fingerprint)
+        if record is not None:
+            return _replay(record, fingerprint)
+
+        try:
+            response = method(self, request, *args, **kwargs)
+        except Exception:
+            release(key)
+            raise
+        if response.status_code >= 500:
+            release(key)
+        else:
+            complete(key, fingerprint, response)
+        return response
+    return wrapper
@@ -0,0 +1,157 @@
+"""
+Every MongoDB index the octofit collections need, declared in one place.
+
+``ensure_indexes`` creates whatever is missing, matching existing indexes by
+key pattern so indexes created earlier under another name (for example by
+djongo for ``unique=True`` fields) are recognised. ``collection_scans``
+explains the main query of each viewset and reports the ones that would
+scan a whole collection.
+"""
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from .mongo import get_db
+
+NEWEST_FIRST = [('created_at', DESCENDING), ('_id', DESCENDING)]
+
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], unique=True),
+        IndexModel([('email', ASCENDING)], unique=True),
+        IndexModel(NEWEST_FIRST),
+        IndexModel([('total_points', DESCENDING)]),
+    ],
+    'teams': [
+        # Multikey: one entry per member id, backing the member -> team lookups
+        IndexModel([('member_ids', ASCENDING)]),
+        IndexModel(NEWEST_FIRST),
+        IndexModel([('total_points', DESCENDING)]),
+    ],
+    'activities': [
+        IndexModel(NEWEST_FIRST),
+        IndexModel([('user_id', ASCENDING)] + NEWEST_FIRST),
+    ],
+    'leaderboard': [
+        IndexModel([('period', ASCENDING), ('period_start', ASCENDING)], unique=True),
+    ],
+    'activity_rollups': [
+        IndexModel([('user_id', ASCENDING), ('day', ASCENDING)], unique=True),
+        # Custom-range leaderboards match days across every user
+        IndexModel([('day', ASCENDING)]),
+    ],
+    'workouts': [
+        IndexModel([('target_fitness_levels', ASCENDING)]),
+        IndexModel([('difficulty_level', ASCENDING)]),
+        IndexModel(NEWEST_FIRST),
+    ],
+    'idempotency_keys': [
+        # Expires recorded responses; lookups go by _id
+        IndexModel([('created_at', ASCENDING)], expireAfterSeconds=settings.IDEMPOTENCY['TTL']),
+    ],
+}
+
+# Options that change what an index means; anything else (name, v, ns) is ignored
+COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+# (description, collection, filter, sort) for the main query behind each viewset
+QUERY_PLANS = [
+    ('UserViewSet.list', 'users', {}, NEWEST_FIRST),
+    ('UserViewSet.teams', 'teams', {'member_ids': 'user-id'}, None),
+    ('TeamViewSet.list', 'teams', {}, NEWEST_FIRST),
+    ('ActivityViewSet.list', 'activities', {}, NEWEST_FIRST),
+    ('ActivityViewSet.list?user_id', 'activities', {'user_id': 'user-id'}, NEWEST_FIRST),
+    ('ActivityViewSet.export', 'activities', {'created_at': {'$gte': 0}}, [('created_at', ASCENDING)]),
+    ('LeaderboardViewSet.list', 'leaderboard', {'period': 'all-time', 'period_start': 0}, None),
+    ('LeaderboardViewSet.teams', 'teams', {}, [('total_points', DESCENDING)]),
+    ('LeaderboardViewSet.list?period=custom', 'activity_rollups', {'day': {'$gte': 0}}, None),
+    ('UserViewSet.stats', 'activity_rollups', {'user_id': 'user-id'}, None),
+    ('TeamViewSet.stats', 'activity_rollups', {'user_id': {'$in': ['user-id']}}, None),
+    ('WorkoutViewSet.list', 'workouts', {}, NEWEST_FIRST),
+    ('WorkoutViewSet.list?difficulty_level', 'workouts', {'difficulty_level': 'beginner'}, None),
+    ('WorkoutViewSet.recommended', 'workouts', {'target_fitness_levels': 'beginner'}, None),
+]
+
+
+def _key(spec):
+    return tuple((field, int(direction) if isinstance(direction, float) else direction)
+                 for field, direction in spec)
+
+
+def _options(spec):
+    return {option: spec[option] for option in COMPARED_OPTIONS if option in spec}
+
+
+def diff_indexes(db=None):
+    """
+    Compare the declared indexes with the database.
+
+    Returns ``(collection, status, name, spec)`` tuples where status is
+    ``'ok'``, ``'missing'``, ``'conflict'`` (same keys, different options)
+    or ``'extra'`` (present but not declared). ``spec`` is the declared
+    IndexModel, or the server's index information for extra indexes.
+    """
+    db = db if db is not None else get_db()
+    changes = []
+    for collection, models in INDEXES.items():
+        existing = {
+            name: info for name, info in db[collection].index_information().items()
+            if name != '_id_'
+        }
+        by_key = {_key(info['key']): name for name, info in existing.items()}
+        for model in models:
+            document = model.document
+            name = by_key.get(_key(document['key'].items()))
+            if name is None:
+                changes.append((collection, 'missing', document['name'], model))
+                continue
+            info = existing.pop(name)
+            status = 'ok' if _options(info) == _options(document) else 'conflict'
+            changes.append((collection, status, name, model))
+        for name, info in existing.items():
+            changes.append((collection, 'extra', name, info))
+    return changes
+
+
+def ensure_indexes(db=None, drop_extra=False):
+    """
+    Create missing indexes (and drop undeclared ones when ``drop_extra``).
+
+    Conflicting indexes are left alone: rebuilding them can lock large
+    collections, so they are only reported. Returns the ``diff_indexes``
+    result the changes were based on.
+    """
+    db = db if db is not None else get_db()
+    changes = diff_indexes(db)
+    missing = {}
+    for collection, status, name, spec in changes:
+        if status == 'missing':
+            missing.setdefault(collection, []).append(spec)
+        elif status == 'extra' and drop_extra:
+            db[collection].drop_index(name)
+    for collection, models in missing.items():
+        db[collection].create_indexes(models)
+    return changes
+
+
+def _has_collection_scan(plan):
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(_has_collection_scan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collection_scan(value) for value in plan)
+    return False
+
+
+def collection_scans(db=None):
+    """Return the descriptions of QUERY_PLANS whose winning plan is a COLLSCAN"""
+    db = db if db is not None else get_db()
+    scans = []
+    for description, collection, query, sort in QUERY_PLANS:
+        cursor = db[collection].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        if _has_collection_scan(plan):
+            scans.append(description)
+    return scans
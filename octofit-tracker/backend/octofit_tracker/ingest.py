@@ -0,0 +1,73 @@
+"""
+Batched activity ingestion for clients that upload many activities at once.
+"""
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+from .activity_changes import ActivityChange, activities_changed
+from .models import Activity
+from .mongo import get_db
+from .serializers import ActivitySerializer
+
+MAX_BATCH_SIZE = 1000
+
+
+def activity_document(validated_data, created_at):
+    """Build the raw document for a validated activity, awarding its points"""
+    activity = Activity(**validated_data)
+    activity.points = activity.calculate_points()
+    document = {
+        field.attname: getattr(activity, field.attname)
+        for field in Activity._meta.concrete_fields
+        if field.attname != '_id'
+    }
+    document['created_at'] = created_at
+    return document
+
+
+def bulk_create_activities(items, db=None):
+    """
+    Validate ``items`` as one batch and insert the valid ones with a single
+    ``insert_many``.
+
+    Returns one result per item in input order: ``{'index', 'id'}`` for
+    inserted activities and ``{'index', 'errors'}`` for rejected ones.
+    Invalid items never prevent the rest of the batch from being written.
+    """
+    results = [{'index': index} for index in range(len(items))]
+    documents = []
+    positions = []
+    # Stored as naive UTC, like djongo does for DateTimeFields
+    created_at = datetime.utcnow()
+    for index, item in enumerate(items):
+        serializer = ActivitySerializer(data=item)
+        if serializer.is_valid():
+            documents.append(activity_document(serializer.validated_data, created_at))
+            positions.append(index)
+        else:
+            results[index]['errors'] = serializer.errors
+
+    if not documents:
+        return results
+
+    db = db if db is not None else get_db()
+    failed = {}
+    try:
+        db.activities.insert_many(documents, ordered=False)
+    except BulkWriteError as error:
+        for write_error in error.details.get('writeErrors', []):
+            failed[write_error['index']] = write_error.get('errmsg', 'Write failed')
+
+    written = []
+    for offset, (index, document) in enumerate(zip(positions, documents)):
+        if offset in failed:
+            results[index]['errors'] = {'non_field_errors': [failed[offset]]}
+            continue
+        results[index]['id'] = str(document['_id'])
+        written.append(ActivityChange(
+            document['user_id'], document['points'], created_at, 1,
+            document['duration'], document['distance'], document['calories'],
+        ))
+    activities_changed(written, db=db)
+    return results
@@ -0,0 +1,370 @@
+"""
+Leaderboard computations run server-side as MongoDB aggregation pipelines.
+
+Rankings are materialized into the ``leaderboard`` collection: one document
+per period (weekly, monthly, all-time) and period start, updated in place as
+activities are written and rebuilt from scratch by ``rebuild_leaderboards``.
+
+Each update in ``record_activities`` rewrites and re-sorts the whole
+``user_rankings`` array of its document, at about 115 bytes of BSON per
+ranked user. A period with 10k active users is a document of about 1.1 MB,
+one with 100k about 11.5 MB, so the all-time leaderboard approaches
+MongoDB's 16 MB document limit, past which its updates fail, at around
+100k users. Beyond that, rankings need a document per user or per page of
+ranks rather than one array per period.
+
+The pipelines need MongoDB 5.2 or newer for ``$sortArray`` (in
+``_merge_entry``); ``$dateTrunc``, used for the period buckets here and by
+``rollups``, needs 5.0.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .mongo import get_db
+
+PERIODS = ('weekly', 'monthly', 'all-time')
+ALL_TIME_START = date(1970, 1, 1)
+
+
+def _username_lookup():
+    """$lookup stage joining a string user id in ``_id.user`` to ``users``"""
+    return {'$lookup': {
+        'from': 'users',
+        'let': {'uid': {'$convert': {
+            'input': '$_id.user', 'to': 'objectId', 'onError': None, 'onNull': None,
+        }}},
+        'pipeline': [
+            {'$match': {'$expr': {'$eq': ['$_id', '$$uid']}}},
+            {'$project': {'username': 1, 'email': 1}},
+        ],
+        'as': 'user',
+    }}
+
+
+def _display_name(path):
+    return {'$ifNull': [f'{path}.username', {'$ifNull': [f'{path}.email', 'Unknown User']}]}
+
+
+def period_bounds(period, when):
+    """Return the (start, end) dates of the ``period`` containing ``when``"""
+    if isinstance(when, datetime):
+        if when.tzinfo is not None:
+            when = when.astimezone(timezone.utc)
+        when = when.date()
+    if period == 'weekly':
+        start = when - timedelta(days=when.weekday())
+        return start, start + timedelta(days=6)
+    if period == 'monthly':
+        start = when.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    if period == 'all-time':
+        return ALL_TIME_START, None
+    raise ValueError(f'Unknown leaderboard period: {period}')
+
+
+def _as_datetime(day):
+    return datetime.combine(day, time.min) if day is not None else None
+
+
+def _document_key(period, start):
+    return {'period': period, 'period_start': _as_datetime(start)}
+
+
+def _bucket_expression(period):
+    if period == 'weekly':
+        return {'$dateTrunc': {'date': '$created_at', 'unit': 'week', 'startOfWeek': 'monday'}}
+    if period == 'monthly':
+        return {'$dateTrunc': {'date': '$created_at', 'unit': 'month'}}
+    return {'$literal': _as_datetime(ALL_TIME_START)}
+
+
+def _team_memberships(db):
+    """Map each member id to the (id, name) of the teams it belongs to"""
+    memberships = {}
+    for team in db.teams.find({}, {'name': 1, 'member_ids': 1}):
+        for member_id in team.get('member_ids') or []:
+            memberships.setdefault(member_id, []).append((str(team['_id']), team.get('name')))
+    return memberships
+
+
+def _team_rankings(user_rows, memberships):
+    totals = {}
+    for row in user_rows:
+        for team_id, team_name in memberships.get(row['user'], []):
+            entry = totals.setdefault(team_id, {
+                'team': team_id, 'team_name': team_name, 'total_points': 0, 'total_activities': 0,
+            })
+            entry['total_points'] += row['total_points']
+            entry['total_activities'] += row['total_activities']
+    return sorted(totals.values(), key=lambda e: (-e['total_points'], e['team']))
+
+
+def _compute_documents(db, period, match=None):
+    """Aggregate activities into leaderboard documents for every bucket of ``period``"""
+    pipeline = [{'$match': match}] if match else []
+    pipeline += [
+        {'$group': {
+            '_id': {'start': _bucket_expression(period), 'user': '$user_id'},
+            'total_points': {'$sum': {'$ifNull': ['$points', 0]}},
+            'total_activities': {'$sum': 1},
+        }},
+        _username_lookup(),
+        {'$unwind': '$user'},
+        {'$sort': {'_id.start': 1, 'total_points': -1, '_id.user': 1}},
+        {'$project': {
+            '_id': 0,
+            'start': '$_id.start',
+            'user': '$_id.user',
+            'user_name': _display_name('$user'),
+            'total_points': 1,
+            'total_activities': 1,
+        }},
+    ]
+    by_start = {}
+    for row in db.activities.aggregate(pipeline, allowDiskUse=True):
+        by_start.setdefault(row.pop('start'), []).append(row)
+
+    memberships = _team_memberships(db)
+    now = datetime.utcnow()
+    documents = []
+    for start, user_rows in by_start.items():
+        _, end = period_bounds(period, start)
+        documents.append({
+            'period': period,
+            'period_start': start,
+            'period_end': _as_datetime(end),
+            'user_rankings': user_rows,
+            'team_rankings': _team_rankings(user_rows, memberships),
+            'last_updated': now,
+        })
+    return documents
+
+
+def rebuild(db=None):
+    """Recompute every materialized leaderboard from the activities collection"""
+    db = db if db is not None else get_db()
+    documents = []
+    for period in PERIODS:
+        documents += _compute_documents(db, period)
+    db.leaderboard.delete_many({'period': {'$in': list(PERIODS)}})
+    if documents:
+        db.leaderboard.insert_many(documents)
+    return len(documents)
+
+
+def materialize(period, start, db=None):
+    """Compute and store the leaderboard document for one period bucket"""
+    db = db if db is not None else get_db()
+    _, end = period_bounds(period, start)
+    match = None
+    if period != 'all-time':
+        match = {'created_at': {
+            '$gte': _as_datetime(start), '$lt': _as_datetime(end + timedelta(days=1)),
+        }}
+    documents = _compute_documents(db, period, match)
+    if documents:
+        document = documents[0]
+    else:
+        document = {
+            'period': period,
+            'period_start': _as_datetime(start),
+            'period_end': _as_datetime(end),
+            'user_rankings': [],
+            'team_rankings': [],
+            'last_updated': datetime.utcnow(),
+        }
+    key = _document_key(period, start)
+    # Insert only if absent: a stored document may already hold increments
+    # that arrived after the aggregation read the activities
+    result = db.leaderboard.update_one(
+        key, {'$setOnInsert': {k: v for k, v in document.items() if k not in key}}, upsert=True
+    )
+    if result.upserted_id is None:
+        document = db.leaderboard.find_one(key)
+    return document
+
+
+def get_rankings(period='all-time', when=None, db=None, limit=None):
+    """
+    Return the materialized leaderboard document for the period containing
+    ``when`` (default: now), materializing it first if it does not exist.
+
+    With ``limit``, only the top ``limit`` user and team entries are read;
+    the stored arrays are kept sorted, so this is a ``$slice`` projection.
+    """
+    db = db if db is not None else get_db()
+    start, _ = period_bounds(period, when or datetime.utcnow())
+    projection = None
+    if limit:
+        projection = {'user_rankings': {'$slice': limit}, 'team_rankings': {'$slice': limit}}
+    document = db.leaderboard.find_one(_document_key(period, start), projection)
+    if document is None:
+        document = materialize(period, start, db)
+        if limit:
+            document['user_rankings'] = document['user_rankings'][:limit]
+            document['team_rankings'] = document['team_rankings'][:limit]
+    return document
+
+
+def range_rankings(start=None, end=None, limit=None, db=None):
+    """
+    Rank users by the points of their activities on the days from ``start``
+    up to, not including, ``end`` (either may be None for an open range).
+
+    Totals come from the daily ``activity_rollups``. With ``limit`` the
+    ``$sort`` is followed by a ``$limit``, which MongoDB runs as a top-K
+    sort holding only ``limit`` rows, and only those users are looked up.
+    Returns entries shaped like a leaderboard document's ``user_rankings``.
+    """
+    db = db if db is not None else get_db()
+    match = {}
+    if start is not None:
+        match['$gte'] = datetime(start.year, start.month, start.day)
+    if end is not None:
+        match['$lt'] = end
+    pipeline = [{'$match': {'day': match}}] if match else []
+    pipeline += [
+        {'$group': {
+            '_id': {'user': '$user_id'},
+            'total_points': {'$sum': '$points'},
+            'total_activities': {'$sum': '$activities'},
+        }},
+        {'$match': {'total_activities': {'$gt': 0}}},
+        {'$sort': {'total_points': -1, '_id.user': 1}},
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline += [
+        _username_lookup(),
+        {'$unwind': '$user'},
+        {'$project': {
+            '_id': 0,
+            'user': '$_id.user',
+            'user_name': _display_name('$user'),
+            'total_points': 1,
+            'total_activities': 1,
+        }},
+    ]
+    return list(db.activity_rollups.aggregate(pipeline, allowDiskUse=True))
+
+
+def ranking_rows(document):
+    """Format a leaderboard document's user rankings for API responses"""
+    return entry_rows(document['user_rankings'])
+
+
+def entry_rows(entries):
+    """Format user ranking entries for API responses"""
+    return [{'id': entry['user'], **entry} for entry in entries]
+
+
+def _merge_entry(source, key, entry):
+    """
+    Pipeline expression adding ``entry``'s totals to the matching element of
+    the ``source`` array, dropping elements left without activities and
+    keeping the array sorted by points.
+    """
+    existing = {'$ifNull': [source, []]}
+    current = {'$ifNull': [
+        {'$arrayElemAt': [
+            {'$filter': {'input': existing, 'cond': {'$eq': [f'$$this.{key}', entry[key]]}}}, 0,
+        ]},
+        {'total_points': 0, 'total_activities': 0},
+    ]}
+    merged = {'$let': {'vars': {'current': current}, 'in': {'$mergeObjects': [
+        '$$current',
+        entry,
+        {
+            'total_points': {'$add': ['$$current.total_points', entry['total_points']]},
+            'total_activities': {'$add': ['$$current.total_activities', entry['total_activities']]},
+        },
+    ]}}}
+    combined = {'$concatArrays': [
+        {'$filter': {'input': existing, 'cond': {'$ne': [f'$$this.{key}', entry[key]]}}},
+        [merged],
+    ]}
+    return {'$sortArray': {
+        'input': {'$filter': {'input': combined, 'cond': {'$gt': ['$$this.total_activities', 0]}}},
+        'sortBy': {'total_points': -1, key: 1},
+    }}
+
+
+def record_activity(user_id, points, created_at, sign=1, db=None):
+    """
+    Add (``sign=1``) or remove (``sign=-1``) one activity's points from every
+    materialized leaderboard it falls in.
+    """
+    record_activities([(user_id, points, created_at, sign)], db=db)
+
+
+def record_activities(changes, db=None):
+    """
+    Apply many ``(user_id, points, created_at, sign, ...)`` changes to the
+    materialized leaderboards.
+
+    Users and teams are looked up with one query each, and every ranking
+    entry is merged with its own atomic pipeline update, all sent in one
+    bulk write, so concurrent writers never lose increments. Documents that
+    were never materialized are left alone: ``get_rankings`` computes them
+    in full from the activities on first read. Team totals follow the
+    users' current memberships; ``rebuild`` reconciles them after
+    membership changes.
+    """
+    deltas = {}
+    for user_id, points, created_at, sign, *_ in changes:
+        user_id = str(user_id)
+        for period in PERIODS:
+            start, end = period_bounds(period, created_at)
+            delta = deltas.setdefault((period, start, end, user_id), [0, 0])
+            delta[0] += (points or 0) * sign
+            delta[1] += sign
+    if not deltas:
+        return
+
+    db = db if db is not None else get_db()
+    user_ids = {key[3] for key in deltas}
+    object_ids = [ObjectId(user_id) for user_id in user_ids if ObjectId.is_valid(user_id)]
+    user_names = {
+        str(user['_id']): user.get('username') or user.get('email') or 'Unknown User'
+        for user in db.users.find({'_id': {'$in': object_ids}}, {'username': 1, 'email': 1})
+    }
+    user_teams = {}
+    for team in db.teams.find({'member_ids': {'$in': list(user_names)}}, {'name': 1, 'member_ids': 1}):
+        for member_id in team.get('member_ids') or []:
+            user_teams.setdefault(member_id, []).append(team)
+
+    entries = {}
+    for (period, start, end, user_id), (points, count) in deltas.items():
+        # Rankings only list existing users
+        if user_id not in user_names or (count == 0 and points == 0):
+            continue
+        doc_entries = entries.setdefault((period, start, end), {})
+        doc_entries[('user_rankings', 'user', user_id)] = {
+            'user': user_id, 'user_name': user_names[user_id],
+            'total_points': points, 'total_activities': count,
+        }
+        for team in user_teams.get(user_id, []):
+            team_id = str(team['_id'])
+            entry = doc_entries.setdefault(('team_rankings', 'team', team_id), {
+                'team': team_id, 'team_name': team.get('name'),
+                'total_points': 0, 'total_activities': 0,
+            })
+            entry['total_points'] += points
+            entry['total_activities'] += count
+
+    operations = []
+    for (period, start, end), doc_entries in entries.items():
+        for (field, key, _), entry in doc_entries.items():
+            new_fields = {
+                'period_end': _as_datetime(end),
+                'user_rankings': {'$ifNull': ['$user_rankings', []]},
+                'team_rankings': {'$ifNull': ['$team_rankings', []]},
+                'last_updated': '$$NOW',
+            }
+            new_fields[field] = _merge_entry(f'${field}', key, entry)
+            operations.append(UpdateOne(_document_key(period, start), [{'$set': new_fields}]))
+    if operations:
+        db.leaderboard.bulk_write(operations)
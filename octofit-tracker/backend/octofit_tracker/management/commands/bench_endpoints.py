@@ -0,0 +1,128 @@
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import monitoring
+from rest_framework.test import APIClient
+import json
+import platform
+import time
+
+from octofit_tracker.benchmarking import (
+    CommandCounter, compare_results, measure, peak_allocated_mb, use_database
+)
+from octofit_tracker.mongo import get_db
+
+# (name, path) of every router endpoint; {user} and {team} are replaced by seeded ids
+ENDPOINTS = [
+    ('users.list', '/api/users/'),
+    ('users.detail', '/api/users/{user}/'),
+    ('users.activities', '/api/users/{user}/activities/'),
+    ('users.teams', '/api/users/{user}/teams/'),
+    ('users.stats?bucket=week', '/api/users/{user}/stats/?bucket=week'),
+    ('teams.list', '/api/teams/'),
+    ('teams.stats?bucket=week', '/api/teams/{team}/stats/?bucket=week'),
+    ('activities.list', '/api/activities/'),
+    ('activities.list?user_id', '/api/activities/?user_id={user}'),
+    ('leaderboard.list', '/api/leaderboard/'),
+    ('leaderboard.teams', '/api/leaderboard/teams/'),
+    ('workouts.list', '/api/workouts/'),
+    ('workouts.recommended', '/api/workouts/recommended/?fitness_level=beginner'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every API endpoint against seeded datasets and write a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--db', default='octofit_bench',
+                            help='Prefix of the scratch databases; one per dataset size')
+        parser.add_argument('--sizes', default='1000,100000,1000000',
+                            help='Comma-separated activity counts to seed')
+        parser.add_argument('--activities-per-user', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already seeded')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--baseline', help='Report of an earlier run to check for regressions')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95 growth over the baseline, as a fraction')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+
+        # Global listeners apply to clients created later: the shared raw
+        # client and the connection use_database reopens are both counted
+        counter = CommandCounter()
+        monitoring.register(counter)
+        client = APIClient(SERVER_NAME='localhost')
+
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'repeat': options['repeat'],
+                'activities_per_user': options['activities_per_user'],
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            },
+            'datasets': {},
+        }
+        for size in sizes:
+            with use_database(f'{options["db"]}_{size}'):
+                report['datasets'][str(size)] = self.run_dataset(client, counter, size, options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = compare_results(json.load(f), report, options['tolerance'])
+            for line in regressions:
+                self.stderr.write(f'REGRESSION {line}')
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+
+    def run_dataset(self, client, counter, size, options):
+        per_user = options['activities_per_user']
+        seed_seconds = None
+        if not options['skip_seed']:
+            start = time.perf_counter()
+            call_command('populate_db', users=max(1, size // per_user), activities_per_user=per_user,
+                         stdout=self.stderr)
+            seed_seconds = round(time.perf_counter() - start, 3)
+
+        db = get_db()
+        user = db.users.find_one({}, {'_id': 1}, sort=[('_id', 1)])
+        team = db.teams.find_one({}, {'_id': 1}, sort=[('_id', 1)])
+        if user is None or team is None:
+            raise CommandError(f'Dataset {size} has no users; run without --skip-seed')
+        responses = caches['responses']
+
+        endpoints = {}
+        for name, path in ENDPOINTS:
+            url = path.format(user=user['_id'], team=team['_id'])
+            # One unmeasured call materializes leaderboards and warms the pool
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} returned {response.status_code}')
+
+            def request():
+                # Measure the database path, not the response cache
+                responses.clear()
+                client.get(url)
+
+            result = measure(request, options['repeat'], counter)
+            # A separate call, so tracing does not slow the timed ones
+            result['peak_alloc_mb'] = peak_allocated_mb(request)
+            endpoints[name] = result
+            self.stderr.write(f'{size} {name}: p95 {result["p95_ms"]}ms, {result["queries"]} queries')
+
+        return {
+            'activities': db.activities.estimated_document_count(),
+            'users': db.users.estimated_document_count(),
+            'seed_seconds': seed_seconds,
+            'endpoints': endpoints,
+        }
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from hashlib import sha1
+import json
+import random
+import time
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from octofit_tracker.benchmarking import percentile
+from octofit_tracker.idempotency import ResponseCache
+
+
+class Command(BaseCommand):
+    help = 'Measure the in-memory Idempotency-Key lookup a retried activity POST pays, at full cache size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type=int, default=100000)
+        parser.add_argument('--entries', type=int, default=settings.IDEMPOTENCY['MAX_ENTRIES'])
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        cache = ResponseCache(options['entries'], settings.IDEMPOTENCY['TTL'])
+        body = {'user_id': '652f1c0e9b1e8a3d4c5b6a79', 'activity_type': 'Running', 'duration': 45,
+                'distance': 7.5, 'calories': 420, 'notes': 'Intervals'}
+        keys = [f'/api/activities/:{rng.getrandbits(128):032x}' for _ in range(options['entries'])]
+        for key in keys:
+            cache.put(key, {'fingerprint': '0' * 40, 'status': 201, 'data': body})
+
+        timings = []
+        hits = 0
+        for _ in range(options['lookups']):
+            key = rng.choice(keys)
+            start = time.perf_counter()
+            # What the decorator does before answering a retry from memory
+            sha1(json.dumps(body, cls=JSONEncoder, sort_keys=True).encode()).hexdigest()
+            hits += cache.get(key) is not None
+            timings.append((time.perf_counter() - start) * 1e6)
+        timings.sort()
+
+        results = {
+            'entries': len(cache),
+            'lookups': options['lookups'],
+            'hits': hits,
+            'p50_us': round(percentile(timings, 50), 2),
+            'p99_us': round(percentile(timings, 99), 2),
+            'max_us': round(timings[-1], 2),
+        }
+        self.stdout.write(json.dumps(results, indent=2))
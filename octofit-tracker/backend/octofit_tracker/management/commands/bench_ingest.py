@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIClient
+import json
+import random
+import tempfile
+import time
+
+from octofit_tracker import write_behind
+from octofit_tracker.benchmarking import percentile, use_database
+from octofit_tracker.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = ('Compare activity ingest throughput of single POSTs (with write-behind off and on) '
+            'and /api/activities/bulk/')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--db', default='octofit_bench', help='Scratch database to write into')
+        parser.add_argument('--count', type=int, default=1000, help='Activities per path')
+        parser.add_argument('--batch-size', type=int, default=50, help='Activities per bulk request')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        items = [
+            {
+                'user_id': str(rng.randint(1, 100)),
+                'activity_type': rng.choice(['Running', 'Cycling', 'Swimming']),
+                'duration': rng.randint(20, 120),
+                'distance': round(rng.uniform(1.0, 20.0), 2),
+                'calories': rng.randint(100, 800),
+            }
+            for _ in range(options['count'])
+        ]
+        client = APIClient(SERVER_NAME='localhost')
+        batch_size = options['batch_size']
+
+        with use_database(options['db']):
+            db = get_db()
+            db.activities.delete_many({})
+
+            single = self.post_each(client, items)
+            single['stored'] = db.activities.count_documents({})
+
+            db.activities.delete_many({})
+            with tempfile.TemporaryDirectory() as log_dir, override_settings(
+                WRITE_BEHIND={**settings.WRITE_BEHIND, 'ENABLED': True, 'LOG_DIR': log_dir}
+            ):
+                buffered = self.post_each(client, items)
+                # Acknowledged is not stored: include draining the buffer
+                start = time.perf_counter()
+                write_behind.stop_buffer()
+                drained = time.perf_counter() - start
+            buffered['stored'] = db.activities.count_documents({})
+            buffered['stored_activities_per_second'] = round(
+                len(items) / (buffered.pop('seconds') + drained), 1
+            )
+
+            db.activities.delete_many({})
+            start = time.perf_counter()
+            for offset in range(0, len(items), batch_size):
+                client.post('/api/activities/bulk/', items[offset:offset + batch_size], format='json')
+            bulk = time.perf_counter() - start
+
+            stored = db.activities.count_documents({})
+
+        results = {
+            'activities': len(items),
+            'single_post': single,
+            'single_post_write_behind': buffered,
+            'bulk': {
+                'batch_size': batch_size,
+                'seconds': round(bulk, 3),
+                'activities_per_second': round(len(items) / bulk, 1),
+                'stored': stored,
+            },
+        }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def post_each(self, client, items):
+        """POST ``items`` one by one; summarise latency and throughput"""
+        timings = []
+        start = time.perf_counter()
+        for item in items:
+            before = time.perf_counter()
+            client.post('/api/activities/', item, format='json')
+            timings.append((time.perf_counter() - before) * 1000)
+        seconds = time.perf_counter() - start
+        timings.sort()
+        return {
+            'seconds': round(seconds, 3),
+            'activities_per_second': round(len(items) / seconds, 1),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+        }
@@ -0,0 +1,101 @@
+from django.core.management.base import BaseCommand
+from bson import ObjectId
+from datetime import datetime, timedelta
+import json
+import random
+
+from octofit_tracker.benchmarking import bench_client, measure
+from octofit_tracker import rollups
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.leaderboard import get_rankings, range_rankings
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the leaderboard endpoint paths (materialization, stored reads, custom ranges) on a synthetic dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--db', default='octofit_bench', help='Scratch database to seed and query')
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--activities', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=100, help='Top-K entries per read, as ?limit=')
+        parser.add_argument('--range-days', type=int, default=30, help='Length of the custom range')
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already in --db')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also time the old per-user loop (2N+1 queries)')
+
+    def handle(self, *args, **options):
+        client, counter = bench_client()
+        db = client[options['db']]
+
+        if not options['skip_seed']:
+            self.seed(db, options['users'], options['activities'])
+
+        limit = options['limit']
+        range_start = datetime.utcnow() - timedelta(days=options['range_days'])
+
+        def materialize():
+            # A first read after rebuild_leaderboards was skipped (the delete is one extra command)
+            db.leaderboard.delete_many({'period': 'all-time'})
+            get_rankings('all-time', db=db, limit=limit)
+
+        results = {
+            'users': db.users.estimated_document_count(),
+            'activities': db.activities.estimated_document_count(),
+            'materialize': measure(materialize, options['repeat'], counter),
+            'stored': measure(lambda: get_rankings('all-time', db=db, limit=limit), options['repeat'], counter),
+            'custom_range': measure(
+                lambda: range_rankings(range_start, None, limit, db=db), options['repeat'], counter
+            ),
+        }
+        if options['compare']:
+            results['per_user_loop'] = measure(lambda: self.per_user_loop(db), 1, counter)
+
+        self.stdout.write(json.dumps(results, indent=2))
+        client.close()
+
+    def seed(self, db, num_users, num_activities, batch_size=10000):
+        """Replace the scratch database contents with random users and activities"""
+        self.stdout.write(f'Seeding {num_users} users and {num_activities} activities...')
+        db.users.delete_many({})
+        db.activities.delete_many({})
+
+        rng = random.Random(42)
+        now = datetime.utcnow()
+        user_ids = [ObjectId() for _ in range(num_users)]
+        for start in range(0, num_users, batch_size):
+            db.users.insert_many([
+                {'_id': user_id, 'username': f'user{start + i}', 'email': f'user{start + i}@example.com'}
+                for i, user_id in enumerate(user_ids[start:start + batch_size])
+            ], ordered=False)
+
+        user_id_strs = [str(user_id) for user_id in user_ids]
+        for start in range(0, num_activities, batch_size):
+            count = min(batch_size, num_activities - start)
+            db.activities.insert_many([
+                {
+                    'user_id': rng.choice(user_id_strs),
+                    'activity_type': 'Running',
+                    'duration': rng.randint(20, 120),
+                    'points': rng.randint(10, 100),
+                    'created_at': now - timedelta(days=rng.randint(0, 365)),
+                }
+                for _ in range(count)
+            ], ordered=False)
+
+        # What populate_db leaves behind: indexes, fresh rollups, no stored leaderboards
+        ensure_indexes(db)
+        rollups.rebuild(db)
+        db.leaderboard.delete_many({})
+
+    def per_user_loop(self, db):
+        """Raw-pymongo equivalent of the leaderboard's former per-user loop"""
+        rows = []
+        for user in db.users.find():
+            user_id = str(user['_id'])
+            total_activities = db.activities.count_documents({'user_id': user_id})
+            total_points = sum(a.get('points') or 0 for a in db.activities.find({'user_id': user_id}))
+            if total_activities > 0 or total_points > 0:
+                rows.append({'user': user_id, 'total_points': total_points})
+        rows.sort(key=lambda x: x['total_points'], reverse=True)
+        return rows
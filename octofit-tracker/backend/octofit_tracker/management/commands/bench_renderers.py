@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+import json
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from octofit_tracker.fast_serializers import compile_rows
+from octofit_tracker.renderers import MessagePackRenderer, ORJSONRenderer, orjson
+from octofit_tracker.serializers import ActivitySerializer
+from octofit_tracker.synthetic import anchor_time, build_chunk
+
+
+class Command(BaseCommand):
+    help = 'Compare encode time and payload size of the JSON and MessagePack renderers on a list page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100, help='Activities per page')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        per_user = 20
+        _, _, activities = build_chunk(
+            42, 0, max(50, options['rows'] // per_user // 50 * 50 + 50), per_user, 50, anchor_time()
+        )
+        fields = tuple(name for name in ActivitySerializer().fields if name != 'user_name')
+        page = {
+            'next': 'http://testserver/api/activities/?cursor=abc',
+            'previous': None,
+            'results': compile_rows(ActivitySerializer, fields).render(activities[:options['rows']]),
+        }
+
+        renderers = {'drf_json': JSONRenderer(), 'msgpack': MessagePackRenderer()}
+        if orjson is not None:
+            renderers['orjson'] = ORJSONRenderer()
+
+        results = {}
+        for name, renderer in renderers.items():
+            body = renderer.render(page)
+            best = min(self.timed(renderer.render, page) for _ in range(options['repeat']))
+            results[name] = {'bytes': len(body), 'encode_ms': round(best * 1000, 3)}
+        for name, entry in results.items():
+            entry['speedup'] = round(results['drf_json']['encode_ms'] / entry['encode_ms'], 2)
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def timed(self, func, data):
+        start = time.perf_counter()
+        func(data)
+        return time.perf_counter() - start
@@ -0,0 +1,69 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+import json
+
+from octofit_tracker import repository
+from octofit_tracker.benchmarking import measure, use_database
+from octofit_tracker.models import Activity, Team, User, Workout
+from octofit_tracker.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = 'Compare the hot reads through djongo with the native pymongo repository queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--db', default='octofit_bench_repository', help='Scratch database to seed and query')
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--activities-per-user', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already in --db')
+
+    def handle(self, *args, **options):
+        with use_database(options['db']):
+            if not options['skip_seed']:
+                call_command('populate_db', users=options['users'],
+                             activities_per_user=options['activities_per_user'], stdout=self.stderr)
+            results = self.run(options)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, options):
+        db = get_db()
+        user = db.users.find_one({}, {'_id': 1}, sort=[('_id', 1)])
+        if user is None:
+            raise CommandError('No users to query; run without --skip-seed')
+        user_id = str(user['_id'])
+        object_ids = [u['_id'] for u in db.users.find({}, {'_id': 1}).limit(options['page_size'])]
+        user_ids = [str(object_id) for object_id in object_ids]
+        limit = options['page_size']
+
+        # (name, djongo read, repository read), each returning a list of rows
+        reads = [
+            ('activities_by_user',
+             lambda: list(Activity.objects.filter(user_id=user_id)
+                          .order_by('-created_at', '-_id').values()[:limit]),
+             lambda: repository.activities_by_user(user_id).seek(None, False, limit)),
+            ('users_by_ids',
+             lambda: list(User.objects.filter(_id__in=object_ids).values('_id', 'username', 'email')),
+             lambda: list(repository.users_by_ids(user_ids).values('username', 'email'))),
+            ('teams_by_member',
+             lambda: list(Team.objects.filter(member_ids__contains=user_id).values()),
+             lambda: list(repository.teams_by_member(user_id))),
+            ('workouts_by_level',
+             lambda: list(Workout.objects.filter(difficulty_level='beginner')
+                          .order_by('-created_at', '-_id').values()[:limit]),
+             lambda: repository.workouts_by_level('beginner').seek(None, False, limit)),
+        ]
+
+        results = {}
+        for name, djongo_read, repository_read in reads:
+            rows = (len(djongo_read()), len(repository_read()))
+            djongo = measure(djongo_read, options['repeat'])
+            native = measure(repository_read, options['repeat'])
+            results[name] = {
+                'rows': {'djongo': rows[0], 'repository': rows[1]},
+                'djongo': djongo,
+                'repository': native,
+                'speedup_p50': round(djongo['p50_ms'] / native['p50_ms'], 2) if native['p50_ms'] else None,
+            }
+        return results
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+import json
+import time
+
+from octofit_tracker.fast_serializers import compile_rows
+from octofit_tracker.models import Activity, Team, User, Workout
+from octofit_tracker.mongo import as_model
+from octofit_tracker.serializers import (
+    ActivitySerializer, TeamSerializer, UserSerializer, WorkoutSerializer
+)
+from octofit_tracker.synthetic import anchor_time, build_chunk, build_workouts
+
+# Method fields that query MongoDB once per page; left out so both paths
+# measure rendering only and the benchmark needs no database
+LOOKUP_FIELDS = {'user_name', 'team_name'}
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/s of the DRF serializers and the compiled fast path on synthetic rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help='Activities to render')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        anchor = anchor_time()
+        per_user = 20
+        users, teams, activities = build_chunk(
+            42, 0, max(50, options['rows'] // per_user // 50 * 50), per_user, 50, anchor
+        )
+        datasets = [
+            (UserSerializer, User, users),
+            (TeamSerializer, Team, teams),
+            (ActivitySerializer, Activity, activities[:options['rows']]),
+            (WorkoutSerializer, Workout, build_workouts(42, 1000, anchor)),
+        ]
+
+        results = {}
+        for serializer_class, model, documents in datasets:
+            fields = tuple(name for name in serializer_class().fields if name not in LOOKUP_FIELDS)
+            instances = [as_model(model, document) for document in documents]
+            rows = compile_rows(serializer_class, fields)
+
+            def drf():
+                serializer = serializer_class(many=True)
+                for name in set(serializer.child.fields) - set(fields):
+                    serializer.child.fields.pop(name)
+                return serializer.to_representation(instances)
+
+            results[serializer_class.__name__] = {
+                'rows': len(documents),
+                'drf_rows_per_second': self.rate(drf, len(documents), options['repeat']),
+                'fast_rows_per_second': self.rate(lambda: rows.render(documents), len(documents),
+                                                  options['repeat']),
+            }
+            entry = results[serializer_class.__name__]
+            entry['speedup'] = round(entry['fast_rows_per_second'] / entry['drf_rows_per_second'], 2)
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def rate(self, func, count, repeat):
+        best = min(self.timed(func) for _ in range(repeat))
+        return round(count / best, 1)
+
+    def timed(self, func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
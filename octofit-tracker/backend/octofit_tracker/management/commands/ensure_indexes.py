@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker.indexes import collection_scans, diff_indexes, ensure_indexes
+
+
+class Command(BaseCommand):
+    help = 'Create the declared MongoDB indexes and check that viewset queries use them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report differences between declared and existing indexes')
+        parser.add_argument('--drop-extra', action='store_true',
+                            help='Drop indexes that are not declared')
+        parser.add_argument('--check', action='store_true',
+                            help='Explain each viewset query and fail on collection scans')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            changes = diff_indexes()
+        else:
+            changes = ensure_indexes(drop_extra=options['drop_extra'])
+
+        for collection, status, name, _ in changes:
+            if status == 'ok':
+                continue
+            if status == 'missing':
+                verb = 'would create' if options['dry_run'] else 'created'
+            elif status == 'extra':
+                verb = 'dropped' if options['drop_extra'] and not options['dry_run'] else 'undeclared'
+            else:
+                verb = 'conflicts with declaration'
+            self.stdout.write(f'{collection}.{name}: {verb}')
+
+        conflicts = [c for c in changes if c[1] == 'conflict']
+        if conflicts:
+            self.stdout.write(self.style.WARNING(
+                f'{len(conflicts)} index(es) differ from their declaration; drop them and rerun to rebuild'
+            ))
+        self.stdout.write(self.style.SUCCESS('Indexes are up to date'
+                                             if not options['dry_run'] else 'Dry run complete'))
+
+        if options['check']:
+            scans = collection_scans()
+            if scans:
+                raise CommandError(f'Collection scans in: {", ".join(scans)}')
+            self.stdout.write(self.style.SUCCESS('No viewset query scans a whole collection'))
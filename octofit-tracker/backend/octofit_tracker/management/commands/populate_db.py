@@ -1,16 +1,40 @@
-from django.core.management.base import BaseCommand
-from pymongo import MongoClient
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+import os
 import random
+import resource
+import time
+
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.leaderboard import rebuild as rebuild_leaderboards
+from octofit_tracker.models import Activity
+from octofit_tracker.mongo import get_db
+from octofit_tracker.rollups import rebuild as rebuild_rollups
+from octofit_tracker.synthetic import anchor_time, build_chunk, build_workouts
+from octofit_tracker.totals import reconcile as reconcile_totals
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        scale = parser.add_argument_group('scale mode', 'Generate synthetic load-test data instead of the sample heroes')
+        scale.add_argument('--users', type=int, help='Number of synthetic users to generate')
+        scale.add_argument('--activities-per-user', type=int, default=50)
+        scale.add_argument('--team-size', type=int, default=50)
+        scale.add_argument('--seed', type=int, default=42)
+        scale.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                           help='Processes building documents')
+        scale.add_argument('--chunk-activities', type=int, default=50000,
+                           help='Approximate activities generated per chunk')
+        scale.add_argument('--batch-size', type=int, default=5000,
+                           help='Documents per insert_many call')
+        scale.add_argument('--workouts', type=int, default=100)
+
     def handle(self, *args, **kwargs):
-        # Connect to MongoDB
-        client = MongoClient('mongodb://localhost:27017/')
-        db = client['octofit_db']
+        # Use the shared, settings-configured MongoDB client
+        db = get_db()
         
         # Clear existing data
         self.stdout.write('Clearing existing data...')
@@ -18,11 +42,16 @@ class Command(BaseCommand):
         db.teams.delete_many({})
         db.activities.delete_many({})
         db.leaderboard.delete_many({})
+        db.activity_rollups.delete_many({})
         db.workouts.delete_many({})
         
-        # Create unique index on email field
-        self.stdout.write('Creating unique index on user email field...')
-        db.users.create_index([('email', 1)], unique=True)
+        if kwargs['users'] is not None:
+            self.populate_scale(db, kwargs)
+            return
+        
+        # Create the declared indexes (unique email, pagination, lookups)
+        self.stdout.write('Creating indexes...')
+        ensure_indexes(db)
         
         # Sample data - Superheroes
         self.stdout.write('Populating users...')
@@ -175,13 +204,15 @@ class Command(BaseCommand):
             # Create 3-7 random activities for each user
             num_activities = random.randint(3, 7)
             for i in range(num_activities):
+                duration = random.randint(20, 120)  # minutes
+                distance = round(random.uniform(1.0, 20.0), 2)  # km
                 activity = {
                     'user_id': user_id,
                     'activity_type': random.choice(activity_types),
-                    'duration': random.randint(20, 120),  # minutes
-                    'distance': round(random.uniform(1.0, 20.0), 2),  # km
+                    'duration': duration,
+                    'distance': distance,
                     'calories': random.randint(100, 800),
-                    'points': random.randint(10, 100),
+                    'points': Activity(duration=duration, distance=distance).calculate_points(),
                     'notes': f"Great {random.choice(activity_types).lower()} session!",
                     'created_at': datetime.now() - timedelta(days=random.randint(0, 30))
                 }
@@ -190,8 +221,9 @@ class Command(BaseCommand):
         activities_result = db.activities.insert_many(activities)
         self.stdout.write(self.style.SUCCESS(f'Inserted {len(activities_result.inserted_ids)} activities'))
         
-        # Populate leaderboard - skip for now as we'll calculate it dynamically
-        self.stdout.write('Skipping static leaderboard (will be calculated dynamically)...')
+        # Fill in user and team total_points from the activities
+        self.stdout.write('Computing user and team totals...')
+        reconcile_totals(db)
         
         # Populate workouts
         self.stdout.write('Populating workouts...')
@@ -293,11 +325,86 @@ class Command(BaseCommand):
         workouts_result = db.workouts.insert_many(workouts)
         self.stdout.write(self.style.SUCCESS(f'Inserted {len(workouts_result.inserted_ids)} workouts'))
         
+        # Materialize leaderboards from the activities inserted above
+        self.stdout.write('Building leaderboards...')
+        leaderboard_count = rebuild_leaderboards(db)
+        self.stdout.write(self.style.SUCCESS(f'Inserted {leaderboard_count} leaderboards'))
+        
+        self.stdout.write('Building activity rollups...')
+        rollup_count = rebuild_rollups(db)
+        self.stdout.write(self.style.SUCCESS(f'Inserted {rollup_count} daily rollups'))
+        
         # Summary
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
         self.stdout.write(self.style.SUCCESS(f'Users: {len(all_users)}'))
         self.stdout.write(self.style.SUCCESS(f'Teams: {len(teams)}'))
         self.stdout.write(self.style.SUCCESS(f'Activities: {len(activities)}'))
         self.stdout.write(self.style.SUCCESS(f'Workouts: {len(workouts)}'))
+
+    def populate_scale(self, db, options):
+        """
+        Generate synthetic data in chunks built by a process pool and written
+        with bounded insert_many batches. At most two chunks per worker are
+        in flight, so peak memory depends on the chunk size, not the total.
+        """
+        users = options['users']
+        per_user = options['activities_per_user']
+        team_size = options['team_size']
+        batch_size = options['batch_size']
+        if users < 1 or per_user < 0 or team_size < 1 or batch_size < 1:
+            raise CommandError('--users, --team-size and --batch-size must be positive')
+        
+        # Chunks hold whole teams so team totals can be computed per chunk
+        teams_per_chunk = max(1, options['chunk_activities'] // max(1, per_user * team_size))
+        chunk_users = teams_per_chunk * team_size
+        anchor = anchor_time()
+        chunks = [
+            (options['seed'], first, min(chunk_users, users - first), per_user, team_size, anchor)
+            for first in range(0, users, chunk_users)
+        ]
+        self.stdout.write(
+            f'Generating {users} users, {users * per_user} activities in {len(chunks)} chunks '
+            f'with {options["workers"]} workers...'
+        )
+        
+        counts = {'users': 0, 'teams': 0, 'activities': 0}
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            pending = []
+            window = 2 * options['workers']
+            for args in chunks:
+                pending.append(pool.submit(build_chunk, *args))
+                if len(pending) >= window:
+                    self.write_chunk(db, pending.pop(0).result(), batch_size, counts, start)
+            for future in pending:
+                self.write_chunk(db, future.result(), batch_size, counts, start)
+        if options['workouts'] > 0:
+            db.workouts.insert_many(build_workouts(options['seed'], options['workouts'], anchor))
+            counts['workouts'] = options['workouts']
+        elapsed = time.perf_counter() - start
+        
+        self.stdout.write('Creating indexes...')
+        ensure_indexes(db)
+        self.stdout.write('Building activity rollups...')
+        rebuild_rollups(db)
+        self.stdout.write('Skipping leaderboards; run rebuild_leaderboards to materialize them')
         
-        client.close()
+        inserted = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS('\n=== Synthetic Population Complete ==='))
+        for collection, count in counts.items():
+            self.stdout.write(self.style.SUCCESS(f'{collection.capitalize()}: {count}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{inserted} documents in {elapsed:.1f}s ({inserted / elapsed:.0f} inserts/s), '
+            f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB'
+        ))
+    
+    def write_chunk(self, db, chunk, batch_size, counts, start):
+        for collection, documents in zip(('users', 'teams', 'activities'), chunk):
+            for offset in range(0, len(documents), batch_size):
+                db[collection].insert_many(documents[offset:offset + batch_size], ordered=False)
+            counts[collection] += len(documents)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'  {counts["users"]} users, {counts["activities"]} activities '
+            f'({sum(counts.values()) / elapsed:.0f} inserts/s)'
+        )
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.leaderboard import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the weekly, monthly and all-time leaderboards from all activities'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding leaderboards...')
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} leaderboard documents'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily activity rollups behind the stats endpoints from all activities'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding activity rollups...')
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} daily rollups'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.totals import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute user and team total_points from activities and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted documents')
+
+    def handle(self, *args, **options):
+        users, teams = reconcile(dry_run=options['dry_run'])
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} drift in {users} users and {teams} teams'))
@@ -54,6 +54,10 @@ class Activity(models.Model):
     def __str__(self):
         return f"{self.activity_type} - {self.duration} min"
 
+    def calculate_points(self):
+        """One point per minute plus one per full kilometre"""
+        return (self.duration or 0) + int(self.distance or 0)
+
 
 class Leaderboard(models.Model):
     _id = models.ObjectIdField(primary_key=True)
@@ -0,0 +1,161 @@
+"""
+Shared access to MongoDB.
+
+Raw pymongo code, background threads and management commands reach
+MongoDB through ``get_client`` / ``get_db``, which hand out one lazily
+created MongoClient per process built from ``settings.MONGO_CLIENT``, so
+every raw query shares one pool whatever thread it runs on. djongo keeps
+its own client per thread for the ORM; ``CONN_MAX_AGE = None`` keeps those
+open across requests. ``pool_metrics`` listens to the pools' events to
+report checkout wait times and connections in use, and
+``request_metrics.command_listener`` attributes commands to the request
+that sent them.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from pymongo import MongoClient, monitoring
+
+from .request_metrics import command_listener
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters fed by pymongo's CMAP events"""
+
+    # Upper bounds (ms) of the checkout wait histogram buckets
+    WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open = 0
+            self.in_use = 0
+            self.max_in_use = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_total_ms = 0.0
+            self.wait_max_ms = 0.0
+            self.wait_buckets = [0] * (len(self.WAIT_BUCKETS_MS) + 1)
+
+    def _wait_ms(self):
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        # Checkout runs on the thread that needs the connection
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait_ms = self._wait_ms()
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            bucket = next(
+                (i for i, bound in enumerate(self.WAIT_BUCKETS_MS) if wait_ms <= bound),
+                len(self.WAIT_BUCKETS_MS),
+            )
+            self.wait_buckets[bucket] += 1
+
+    def connection_check_out_failed(self, event):
+        self._wait_ms()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open = max(0, self.open - 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f'<={bound}ms' for bound in self.WAIT_BUCKETS_MS] + [f'>{self.WAIT_BUCKETS_MS[-1]}ms']
+            return {
+                'max_pool_size': settings.MONGO_CLIENT.get('maxPoolSize'),
+                'min_pool_size': settings.MONGO_CLIENT.get('minPoolSize'),
+                'open_connections': self.open,
+                'in_use': self.in_use,
+                'max_in_use': self.max_in_use,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_mean_ms': round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max_ms, 3),
+                'wait_histogram': dict(zip(labels, self.wait_buckets)),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+def install_monitoring():
+    """Register process-wide pymongo listeners; must run before any client is created"""
+    monitoring.register(pool_metrics)
+    monitoring.register(command_listener)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(**settings.MONGO_CLIENT)
+    return _client
+
+
+def get_db():
+    """Return the pymongo Database the default connection is configured for"""
+    # Read per call: the test runner and benchmarks switch databases by name
+    return get_client()[connection.settings_dict['NAME']]
+
+
+def new_client(**overrides):
+    """
+    Create a separate MongoClient from ``settings.MONGO_CLIENT``.
+
+    Only for tools that need their own listeners or options, such as the
+    benchmarks; application code should use ``get_client``.
+    """
+    return MongoClient(**{**settings.MONGO_CLIENT, **overrides})
+
+
+def as_model(model, document):
+    """Build a model instance from a raw document without another query"""
+    fields = model._meta.concrete_fields
+    return model.from_db(
+        connection.alias,
+        [field.attname for field in fields],
+        [document.get(field.attname, field.get_default()) for field in fields],
+    )
@@ -0,0 +1,97 @@
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+from .repository import MongoQuery
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination keyed on the unique ``(created_at, _id)`` pair.
+
+    DRF's CursorPagination only seeks on the first ordering field and skips
+    rows sharing that value with an offset. Seeking on both fields keeps
+    every page a bounded range scan over the ``(created_at, _id)`` index,
+    so page N costs the same as page 1. Pages are ORM querysets or
+    ``repository.MongoQuery`` reads, which seek the same way in pymongo.
+    Rows without a ``created_at`` (inserted around the ORM) are left out:
+    no cursor position can point at them or past them.
+    """
+    ordering = ('-created_at', '-_id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.request = request
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor.reverse)
+
+        position = self.decode_position(cursor.position) if cursor and cursor.position else None
+        if isinstance(queryset, MongoQuery):
+            rows = queryset.seek(position, self.reverse, self.page_size + 1)
+        else:
+            rows = list(self.seek(queryset, position)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_previous = has_more
+            self.has_next = cursor is not None
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        return self.page
+
+    def seek(self, queryset, position):
+        queryset = queryset.filter(created_at__isnull=False)
+        if self.reverse:
+            queryset = queryset.order_by('created_at', '_id')
+        else:
+            queryset = queryset.order_by('-created_at', '-_id')
+        if position is not None:
+            created_at, pk = position
+            op = 'gt' if self.reverse else 'lt'
+            queryset = queryset.filter(
+                Q(**{f'created_at__{op}': created_at}) |
+                Q(created_at=created_at, **{f'_id__{op}': pk})
+            )
+        return queryset
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False, position=self.encode_position(self.page[-1])
+        ))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=True, position=self.encode_position(self.page[0])
+        ))
+
+    def encode_position(self, row):
+        # Pages hold model instances or values() dicts; seek() only returns
+        # rows that have a created_at
+        if isinstance(row, dict):
+            return f'{row["created_at"].isoformat()}|{row["_id"]}'
+        return f'{row.created_at.isoformat()}|{row._id}'
+
+    def decode_position(self, position):
+        try:
+            created_at, pk = position.split('|')
+            return datetime.fromisoformat(created_at), ObjectId(pk)
+        except (ValueError, InvalidId):
+            raise NotFound(self.invalid_cursor_message)
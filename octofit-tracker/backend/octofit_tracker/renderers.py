@@ -0,0 +1,110 @@
+"""
+Faster JSON and binary MessagePack renderers and parsers.
+
+``ORJSONRenderer`` / ``ORJSONParser`` handle ``application/json`` with
+orjson, keeping DRF's conventions (compact separators, UTF-8, ``Z``
+suffixed UTC datetimes, escaped U+2028/U+2029). Floats may be spelled
+differently (``1e16`` rather than ``1e+16``) and NaN and infinities are
+written as ``null`` where DRF refuses them. Data orjson cannot encode,
+such as integers wider than 64 bits, goes through DRF's encoder instead.
+
+``MessagePackRenderer`` / ``MessagePackParser`` handle
+``application/msgpack``. Datetimes travel as MessagePack timestamps (naive
+values are UTC, as stored) and ObjectIds as extension type
+``OBJECT_ID_EXT`` holding the 12 id bytes.
+"""
+from datetime import datetime, timezone
+
+from bson import ObjectId
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+OBJECT_ID_EXT = 1
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    """Encode what the fast encoders do not handle natively, like DRF does"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """``application/json`` encoded with orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Indented output (browsable API, ``; indent=``) keeps DRF's encoder
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=_default,
+                # Datetimes go through _default so they match DRF's JSONEncoder
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping of the JavaScript line separators as JSONRenderer
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(JSONParser):
+    """``application/json`` decoded with orjson"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+def _pack_default(obj):
+    if isinstance(obj, ObjectId):
+        return msgpack.ExtType(OBJECT_ID_EXT, obj.binary)
+    if isinstance(obj, datetime):
+        # Only reached for naive datetimes, which are stored as UTC
+        return obj.replace(tzinfo=timezone.utc)
+    return _default(obj)
+
+
+def _ext_hook(code, data):
+    if code == OBJECT_ID_EXT:
+        return ObjectId(data)
+    return msgpack.ExtType(code, data)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_pack_default, datetime=True, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), ext_hook=_ext_hook, timestamp=3, raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
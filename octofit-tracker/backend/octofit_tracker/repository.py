@@ -0,0 +1,79 @@
+"""
+Native pymongo queries for the hot read paths.
+
+djongo turns every ORM query into SQL and parses it back into a MongoDB
+query, which costs CPU on each request. The reads below are the ones every
+page load makes, so they build their filters directly and return raw
+documents. ``MongoQuery`` supports the parts of the QuerySet API the
+viewsets use (``values()`` and iteration), and ``KeysetPagination`` pages
+it with the same ``(created_at, _id)`` seek as querysets, so
+``fast_response`` renders either one. Writes stay on the ORM.
+"""
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from .indexes import NEWEST_FIRST
+from .mongo import get_db
+
+OLDEST_FIRST = [(field, ASCENDING) for field, _ in NEWEST_FIRST]
+
+
+class MongoQuery:
+    """A lazy ``find()`` on one collection"""
+
+    def __init__(self, collection, query, fields=None, sort=NEWEST_FIRST):
+        self.collection = collection
+        self.query = query
+        self.fields = fields
+        self.sort = sort
+
+    def values(self, *fields):
+        """Return a copy loading only ``fields`` (plus ``_id``)"""
+        return MongoQuery(self.collection, self.query, fields or None, self.sort)
+
+    def find(self, query=None, sort=None, limit=0, db=None):
+        db = db if db is not None else get_db()
+        projection = dict.fromkeys(self.fields, 1) if self.fields else None
+        cursor = db[self.collection].find(self.query if query is None else query, projection)
+        return cursor.sort(sort or self.sort).limit(limit)
+
+    def __iter__(self):
+        return iter(self.find())
+
+    def seek(self, position, reverse, limit, db=None):
+        """
+        Return up to ``limit`` documents after ``position`` (a
+        ``(created_at, _id)`` pair, or None for the first page) in newest
+        first order, or before it in oldest first order when ``reverse``.
+        Documents without a ``created_at`` are skipped, like the ORM seek.
+        """
+        query = {'$and': [self.query, {'created_at': {'$ne': None}}]}
+        if position is not None:
+            created_at, pk = position
+            op = '$gt' if reverse else '$lt'
+            query['$and'].append({'$or': [
+                {'created_at': {op: created_at}},
+                {'created_at': created_at, '_id': {op: pk}},
+            ]})
+        return list(self.find(query, OLDEST_FIRST if reverse else NEWEST_FIRST, limit, db))
+
+
+def activities_by_user(user_id):
+    """A user's activities, newest first"""
+    return MongoQuery('activities', {'user_id': user_id})
+
+
+def users_by_ids(user_ids):
+    """The users with the given id strings; invalid ids are skipped"""
+    object_ids = list({ObjectId(user_id) for user_id in user_ids if user_id and ObjectId.is_valid(user_id)})
+    return MongoQuery('users', {'_id': {'$in': object_ids}})
+
+
+def teams_by_member(user_id):
+    """The teams listing ``user_id`` as a member, oldest first"""
+    return MongoQuery('teams', {'member_ids': user_id}, sort=[('_id', ASCENDING)])
+
+
+def workouts_by_level(difficulty_level):
+    """The workouts of one difficulty level, newest first"""
+    return MongoQuery('workouts', {'difficulty_level': difficulty_level})
@@ -0,0 +1,209 @@
+"""
+Per-request MongoDB command metrics.
+
+``RequestMetricsMiddleware`` opens a ``RequestStats`` for a sampled request
+and ``command_listener``, registered process-wide with pymongo, adds every
+command that finishes while it is open. The totals go out in a
+``Server-Timing`` header and into per-route histograms served by
+``/api/metrics/``.
+
+The current stats live in a context variable, which ``sync_to_async`` and
+``async_to_sync`` carry into their worker threads. Requests that are not
+sampled leave it unset, so the listener returns after a single lookup.
+"""
+from contextvars import ContextVar
+import random
+import threading
+import time
+
+from django.conf import settings
+from pymongo import monitoring
+
+_current = ContextVar('octofit_request_stats', default=None)
+
+
+class RequestStats:
+    """Commands, database time and slowest command of one request"""
+
+    __slots__ = ('commands', 'db_ms', 'slowest_ms', 'slowest_command', '_lock')
+
+    def __init__(self):
+        self.commands = 0
+        self.db_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_command = None
+        # Async views run several loaders in parallel threads
+        self._lock = threading.Lock()
+
+    def add(self, command_name, duration_ms):
+        with self._lock:
+            self.commands += 1
+            self.db_ms += duration_ms
+            if duration_ms >= self.slowest_ms:
+                self.slowest_ms = duration_ms
+                self.slowest_command = command_name
+
+
+class CommandListener(monitoring.CommandListener):
+    """Feed finished commands into the current request's stats, if any"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        stats = _current.get()
+        if stats is not None:
+            stats.add(event.command_name, event.duration_micros / 1000)
+
+    def failed(self, event):
+        stats = _current.get()
+        if stats is not None:
+            stats.add(event.command_name, event.duration_micros / 1000)
+
+
+class Histogram:
+    """Counts of observations at or below each bound, plus an overflow bucket"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[next(
+            (i for i, bound in enumerate(self.bounds) if value <= bound),
+            len(self.bounds),
+        )] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self, unit):
+        count = sum(self.buckets)
+        labels = [f'<={bound}{unit}' for bound in self.bounds] + [f'>{self.bounds[-1]}{unit}']
+        return {
+            'mean': round(self.total / count, 3) if count else 0.0,
+            'max': round(self.max, 3),
+            'histogram': dict(zip(labels, self.buckets)),
+        }
+
+
+class RouteMetrics:
+    """Per-route histograms of request time, database time and command count"""
+
+    TIME_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+    COMMAND_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+
+    def record(self, route, elapsed_ms, stats):
+        with self._lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = self.routes[route] = {
+                    'requests': 0,
+                    'elapsed': Histogram(self.TIME_BUCKETS_MS),
+                    'db': Histogram(self.TIME_BUCKETS_MS),
+                    'commands': Histogram(self.COMMAND_BUCKETS),
+                    'slowest_ms': 0.0,
+                    'slowest_command': None,
+                }
+            entry['requests'] += 1
+            entry['elapsed'].observe(elapsed_ms)
+            entry['db'].observe(stats.db_ms)
+            entry['commands'].observe(stats.commands)
+            if stats.slowest_ms >= entry['slowest_ms']:
+                entry['slowest_ms'] = stats.slowest_ms
+                entry['slowest_command'] = stats.slowest_command
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                route: {
+                    'requests': entry['requests'],
+                    'elapsed_ms': entry['elapsed'].snapshot('ms'),
+                    'db_ms': entry['db'].snapshot('ms'),
+                    'commands': entry['commands'].snapshot(''),
+                    'slowest_ms': round(entry['slowest_ms'], 3),
+                    'slowest_command': entry['slowest_command'],
+                }
+                for route, entry in sorted(self.routes.items())
+            }
+
+
+command_listener = CommandListener()
+route_metrics = RouteMetrics()
+
+
+def _route(request):
+    match = request.resolver_match
+    name = (match.view_name or match.route) if match else 'unresolved'
+    return f'{request.method} {name}'
+
+
+def server_timing(stats, elapsed_ms):
+    """Format ``stats`` as a Server-Timing header value"""
+    parts = [
+        f'db;dur={stats.db_ms:.3f};desc="{stats.commands} commands"',
+        f'app;dur={elapsed_ms:.3f}',
+    ]
+    if stats.slowest_command:
+        parts.append(f'db-slowest;dur={stats.slowest_ms:.3f};desc="{stats.slowest_command}"')
+    return ', '.join(parts)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record database commands of a sample of requests, controlled by
+    ``settings.REQUEST_METRICS['SAMPLE_RATE']`` (0 turns recording off).
+
+    A streaming response runs most of its commands while the server
+    iterates its body, after the headers are sent, so it gets no
+    ``Server-Timing`` header; its route metrics are recorded once the body
+    is exhausted or closed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = settings.REQUEST_METRICS['SAMPLE_RATE']
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        if response.streaming:
+            response.streaming_content = self._measure(response.streaming_content, request, stats, start)
+            return response
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        response['Server-Timing'] = server_timing(stats, elapsed_ms)
+        route_metrics.record(_route(request), elapsed_ms, stats)
+        return response
+
+    def _measure(self, content, request, stats, start):
+        """Yield ``content`` with ``stats`` current while each chunk is produced"""
+        try:
+            while True:
+                token = _current.set(stats)
+                try:
+                    chunk = next(content)
+                except StopIteration:
+                    return
+                finally:
+                    _current.reset(token)
+                yield chunk
+        finally:
+            route_metrics.record(_route(request), (time.perf_counter() - start) * 1000, stats)
@@ -0,0 +1,117 @@
+"""
+Response caching with ETags for read-heavy viewset actions.
+
+Each collection has a version counter in the response cache that writes
+bump. Responses are cached under a key derived from the request and the
+versions of the collections it reads, together with an ETag hashed from
+their content, so a matching ``If-None-Match`` is answered with 304 from
+the cache alone, without touching MongoDB.
+
+The backend is whichever Django cache ``settings.RESPONSE_CACHE['ALIAS']``
+names (local memory or file based, see ``settings.CACHES``). Version
+counters live in that backend, so processes only share invalidations when
+they share the backend. Writes a process does not see (other processes on
+a local memory backend, ``populate_db``, the admin) therefore show up once
+the cached responses expire after ``TIMEOUT`` seconds: neither a hit nor a
+304 is served without a live cache entry, and the ETag of the recomputed
+response only matches when its content is unchanged.
+"""
+from functools import wraps
+from hashlib import sha1
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+_stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE['ALIAS']]
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def collection_version(collection):
+    """Return the current version of ``collection``"""
+    cache = _cache()
+    key = f'version:{collection}'
+    # Seed with the clock so a restarted local cache never reuses old ETags
+    cache.add(key, time.time_ns(), None)
+    return cache.get(key)
+
+
+def bump_version(collection):
+    """Invalidate every cached response that reads ``collection``"""
+    cache = _cache()
+    try:
+        cache.incr(f'version:{collection}')
+    except ValueError:
+        cache.set(f'version:{collection}', time.time_ns(), None)
+
+
+def cache_stats():
+    """Return hit/miss counters for this process and the resulting hit rate"""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = sum(stats.values())
+    stats['hit_rate'] = round((stats['hits'] + stats['not_modified']) / total, 4) if total else 0.0
+    return stats
+
+
+def etag_matches(etag, if_none_match):
+    """
+    Whether an ``If-None-Match`` header lists ``etag``: it is ``*``, or one
+    of its comma separated ETags equals ``etag`` once a weak ``W/`` prefix
+    is dropped (the weak comparison RFC 9110 prescribes for this header).
+    """
+    etags = parse_etags(if_none_match)
+    if etags == ['*']:
+        return True
+    return any(tag.removeprefix('W/') == etag for tag in etags)
+
+
+def cached_response(*collections):
+    """
+    Cache the decorated viewset action's 200 responses until one of
+    ``collections`` is written, and answer conditional GETs with 304.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            representation = [request.get_full_path(), request.META.get('HTTP_ACCEPT', '')]
+            versions = [collection_version(collection) for collection in collections]
+            key = f'response:{sha1(json.dumps(representation + versions).encode()).hexdigest()}'
+
+            cache = _cache()
+            cached = cache.get(key)
+            if cached is not None:
+                etag, data = cached
+                if etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+                    _count('not_modified')
+                    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+                _count('hits')
+                return Response(data, headers={'ETag': etag, 'X-Cache': 'HIT'})
+
+            _count('misses')
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                # Store plain JSON types so any cache backend can pickle them
+                body = json.dumps(response.data, cls=JSONEncoder)
+                etag = f'"{sha1(json.dumps(representation + [body]).encode()).hexdigest()}"'
+                cache.set(key, (etag, json.loads(body)), settings.RESPONSE_CACHE['TIMEOUT'])
+                response['ETag'] = etag
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
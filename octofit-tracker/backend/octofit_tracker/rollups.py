@@ -0,0 +1,129 @@
+"""
+Daily activity rollups behind the user and team statistics endpoints.
+
+``activity_rollups`` holds one document per user and UTC day with the
+summed duration, distance, calories and points of that day's activities.
+It is kept current with ``$inc`` upserts as activities change and rebuilt
+from scratch by ``rebuild``. Statistics by day, week or month group those
+rows with ``$dateTrunc`` (MongoDB 5.0 or newer), so a year of history
+reads at most 365 small documents per user instead of every activity.
+"""
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .mongo import get_db
+
+BUCKETS = ('day', 'week', 'month')
+METRICS = ('duration', 'distance', 'calories', 'points')
+
+
+def _day(created_at):
+    return datetime(created_at.year, created_at.month, created_at.day)
+
+
+def record_stats(changes, db=None):
+    """Apply ``ActivityChange`` tuples to the daily rollups of their users"""
+    deltas = {}
+    for change in changes:
+        if change.created_at is None:
+            continue
+        key = (str(change.user_id), _day(change.created_at))
+        delta = deltas.setdefault(key, dict.fromkeys(METRICS + ('activities',), 0))
+        for metric in METRICS:
+            delta[metric] += (getattr(change, metric) or 0) * change.sign
+        delta['activities'] += change.sign
+    deltas = {key: delta for key, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+
+    db = db if db is not None else get_db()
+    db.activity_rollups.bulk_write([
+        UpdateOne({'user_id': user_id, 'day': day}, {'$inc': delta}, upsert=True)
+        for (user_id, day), delta in deltas.items()
+    ], ordered=False)
+    if any(delta['activities'] < 0 for delta in deltas.values()):
+        db.activity_rollups.delete_many({
+            '$or': [{'user_id': user_id, 'day': day} for user_id, day in deltas],
+            'activities': {'$lte': 0},
+        })
+
+
+def rebuild(db=None):
+    """Recompute every daily rollup from the activities collection"""
+    db = db if db is not None else get_db()
+    # $out swaps the collection in atomically and keeps its indexes
+    db.activities.aggregate([
+        {'$match': {'created_at': {'$type': 'date'}}},
+        {'$group': {
+            '_id': {
+                'user_id': '$user_id',
+                'day': {'$dateTrunc': {'date': '$created_at', 'unit': 'day'}},
+            },
+            **{metric: {'$sum': {'$ifNull': [f'${metric}', 0]}} for metric in METRICS},
+            'activities': {'$sum': 1},
+        }},
+        {'$project': {
+            '_id': 0,
+            'user_id': '$_id.user_id',
+            'day': '$_id.day',
+            **{metric: 1 for metric in METRICS + ('activities',)},
+        }},
+        {'$out': 'activity_rollups'},
+    ], allowDiskUse=True)
+    return db.activity_rollups.estimated_document_count()
+
+
+def _stats(match, bucket, start, end, db):
+    if bucket not in BUCKETS:
+        raise ValueError(f'Unknown stats bucket: {bucket}')
+    if start is not None or end is not None:
+        match['day'] = {}
+        if start is not None:
+            match['day']['$gte'] = _day(start)
+        if end is not None:
+            match['day']['$lt'] = end
+    trunc = {'date': '$day', 'unit': bucket}
+    if bucket == 'week':
+        trunc['startOfWeek'] = 'monday'
+    rows = db.activity_rollups.aggregate([
+        {'$match': match},
+        {'$group': {
+            '_id': {'$dateTrunc': trunc},
+            **{metric: {'$sum': f'${metric}'} for metric in METRICS + ('activities',)},
+        }},
+        {'$sort': {'_id': 1}},
+    ])
+    return [
+        {
+            'period_start': row.pop('_id'),
+            **row,
+            'distance': round(row['distance'], 2),
+        }
+        for row in rows
+    ]
+
+
+def user_stats(user_id, bucket='day', start=None, end=None, db=None):
+    """
+    Totals of one user's activities per ``bucket`` (day, week or month),
+    optionally limited to the days from ``start`` up to, not including,
+    ``end``. Each row has ``period_start``, the summed metrics and the
+    number of ``activities``.
+    """
+    db = db if db is not None else get_db()
+    return _stats({'user_id': str(user_id)}, bucket, start, end, db)
+
+
+def team_stats(team_id, bucket='day', start=None, end=None, db=None):
+    """
+    Totals of the activities of a team's current members per ``bucket``.
+    Returns None when the team does not exist.
+    """
+    db = db if db is not None else get_db()
+    team = db.teams.find_one({'_id': ObjectId(team_id)}, {'member_ids': 1}) if ObjectId.is_valid(team_id) else None
+    if team is None:
+        return None
+    members = list(set(team.get('member_ids') or []))
+    return _stats({'user_id': {'$in': members}}, bucket, start, end, db)
@@ -1,18 +1,105 @@
+from datetime import datetime
+
+from bson import ObjectId
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from .models import User, Team, Activity, Leaderboard, Workout
+from .repository import users_by_ids
+from .team_index import team_names_by_member
+
+
+def resolve_user_names(user_ids):
+    """Map user id strings to display names with a single $in query"""
+    user_ids = [user_id for user_id in user_ids if user_id and ObjectId.is_valid(user_id)]
+    if not user_ids:
+        return {}
+    return {
+        str(user['_id']): user.get('username') or user.get('email') or 'Unknown User'
+        for user in users_by_ids(user_ids).values('username', 'email')
+    }
+
 
+class SparseFieldsMixin:
+    """
+    Trim a serializer's fields for GET requests.
+
+    ``?fields=a,b`` keeps only the named fields and ``?compact=1`` drops the
+    aliases listed in ``Meta.aliases``. Fields are removed before rendering,
+    so method fields that were not asked for are never computed.
+    ``Meta.method_sources`` names the model fields each method field reads,
+    which ``projection`` uses to load only the columns the output needs.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sparse = False
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        params = request.query_params
+        
+        requested = params.get('fields')
+        if requested:
+            names = {name.strip() for name in requested.split(',') if name.strip()}
+            unknown = names - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError({'fields': [f'Unknown field: {name}' for name in sorted(unknown)]})
+            for name in set(self.fields) - names:
+                self.fields.pop(name)
+            self.sparse = True
+        
+        if params.get('compact') in ('1', 'true'):
+            for name in getattr(self.Meta, 'aliases', ()):
+                self.fields.pop(name, None)
+            self.sparse = True
+    
+    def projection(self):
+        """
+        Return the model fields the remaining serializer fields read, or None
+        when no fields were dropped and the whole document is needed.
+        """
+        if not self.sparse:
+            return None
+        sources = getattr(self.Meta, 'method_sources', {})
+        needed = {self.Meta.model._meta.pk.attname}
+        for name, field in self.fields.items():
+            if name in sources:
+                needed.update(sources[name])
+            elif field.source != '*':
+                needed.add(field.source.split('.')[0])
+        return needed
 
-class UserSerializer(serializers.ModelSerializer):
+
+class UserListSerializer(serializers.ListSerializer):
+    """Resolve the team names of a whole page of users in one query"""
+    
+    def to_representation(self, data):
+        users = list(data.all() if hasattr(data, 'all') else data)
+        if 'team_name' in self.child.fields:
+            self.child.team_names = team_names_by_member(str(u._id) for u in users)
+        try:
+            return super().to_representation(users)
+        finally:
+            self.child.team_names = None
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
     date_joined = serializers.DateTimeField(source='created_at', read_only=True)
     team_name = serializers.SerializerMethodField()
     
+    # Filled in by UserListSerializer while rendering a page
+    team_names = None
+    
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 
                   'fitness_level', 'total_points', 'created_at', 'updated_at',
                   'date_joined', 'team_name']
         read_only_fields = ['id', 'total_points', 'created_at', 'updated_at', 'date_joined']
+        list_serializer_class = UserListSerializer
+        aliases = ['date_joined']
+        method_sources = {'id': ['_id'], 'team_name': ['_id']}
     
     def get_id(self, obj):
         """Convert ObjectId to string"""
@@ -20,14 +107,13 @@ class UserSerializer(serializers.ModelSerializer):
     
     def get_team_name(self, obj):
         """Get team name for the user"""
-        from .models import Team
         user_id_str = str(obj._id)
-        # Find team where user_id is in member_ids
-        team = Team.objects.filter(member_ids__contains=user_id_str).first()
-        return team.name if team else None
+        if self.team_names is None:
+            return team_names_by_member([user_id_str]).get(user_id_str)
+        return self.team_names.get(user_id_str)
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
     member_count = serializers.SerializerMethodField()
     
@@ -36,6 +122,7 @@ class TeamSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'captain_id', 'member_ids', 
                   'total_points', 'created_at', 'updated_at', 'member_count']
         read_only_fields = ['id', 'total_points', 'created_at', 'updated_at', 'member_count']
+        method_sources = {'id': ['_id'], 'member_count': ['member_ids']}
     
     def get_id(self, obj):
         """Convert ObjectId to string"""
@@ -48,25 +135,78 @@ class TeamSerializer(serializers.ModelSerializer):
         return 0
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class TeamMembershipSerializer(serializers.Serializer):
+    """
+    The ``user_id`` or ``user_ids`` of a team membership change, from JSON
+    or from form fields (``user_ids`` repeated)
+    """
+    user_id = serializers.CharField(max_length=100, required=False)
+    user_ids = serializers.ListField(
+        child=serializers.CharField(max_length=100), allow_empty=False, required=False
+    )
+    
+    def validate(self, attrs):
+        """Require one of the fields and return the distinct ids as ``user_ids``"""
+        user_ids = attrs.get('user_ids')
+        if user_ids is None and 'user_id' in attrs:
+            user_ids = [attrs['user_id']]
+        if not user_ids:
+            raise serializers.ValidationError('user_id or a list of user_ids is required')
+        return {'user_ids': list(dict.fromkeys(user_ids))}
+
+
+class ActivityListSerializer(serializers.ListSerializer):
+    """Resolve the user names of a whole page of activities in one query"""
+    
+    def to_representation(self, data):
+        activities = list(data.all() if hasattr(data, 'all') else data)
+        if 'user_name' in self.child.fields:
+            self.child.user_names = resolve_user_names(a.user_id for a in activities)
+        try:
+            return super().to_representation(activities)
+        finally:
+            self.child.user_names = None
+
+
+class ActivitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
     user_name = serializers.SerializerMethodField()
-    calories_burned = serializers.IntegerField(source='calories', allow_null=True)
+    calories_burned = serializers.IntegerField(source='calories', allow_null=True, required=False)
     date = serializers.DateTimeField(source='created_at', read_only=True)
     
+    # Filled in by ActivityListSerializer while rendering a page
+    user_names = None
+    
     class Meta:
         model = Activity
         fields = ['id', 'user_id', 'user_name', 'activity_type', 'duration', 'distance', 
                   'calories', 'calories_burned', 'points', 'notes', 'created_at', 'date']
         read_only_fields = ['id', 'points', 'created_at', 'date']
+        list_serializer_class = ActivityListSerializer
+        aliases = ['calories_burned', 'date']
+        method_sources = {'id': ['_id'], 'user_name': ['user_id']}
     
     def get_id(self, obj):
         """Convert ObjectId to string"""
         return str(obj._id) if obj._id else None
     
+    def create(self, validated_data):
+        """Award points for the activity when it is logged"""
+        validated_data['points'] = Activity(**validated_data).calculate_points()
+        return super().create(validated_data)
+    
+    def update(self, instance, validated_data):
+        """Re-award points, which follow the duration and distance"""
+        validated_data['points'] = Activity(
+            duration=validated_data.get('duration', instance.duration),
+            distance=validated_data.get('distance', instance.distance),
+        ).calculate_points()
+        return super().update(instance, validated_data)
+    
     def get_user_name(self, obj):
         """Get username for the activity"""
-        from bson import ObjectId
+        if self.user_names is not None:
+            return self.user_names.get(obj.user_id, 'Unknown User')
         try:
             # Convert string user_id to ObjectId
             if obj.user_id:
@@ -78,8 +218,19 @@ class ActivitySerializer(serializers.ModelSerializer):
         return 'Unknown User'
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class StoredDateField(serializers.DateField):
+    """DateField for dates MongoDB stores as midnight datetimes"""
+    
+    def to_representation(self, value):
+        if isinstance(value, datetime):
+            value = value.date()
+        return super().to_representation(value)
+
+
+class LeaderboardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
+    period_start = StoredDateField()
+    period_end = StoredDateField(allow_null=True, required=False)
     user_name = serializers.SerializerMethodField()
     total_points = serializers.SerializerMethodField()
     total_activities = serializers.SerializerMethodField()
@@ -90,6 +241,9 @@ class LeaderboardSerializer(serializers.ModelSerializer):
                   'user_rankings', 'team_rankings', 'last_updated',
                   'user_name', 'total_points', 'total_activities']
         read_only_fields = ['id', 'last_updated']
+        # Placeholder fields; compact mode drops them too
+        aliases = ['user_name', 'total_points', 'total_activities']
+        method_sources = {'id': ['_id'], 'user_name': [], 'total_points': [], 'total_activities': []}
     
     def get_id(self, obj):
         """Convert ObjectId to string"""
@@ -108,7 +262,7 @@ class LeaderboardSerializer(serializers.ModelSerializer):
         return 0
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
     name = serializers.CharField(source='title')
     duration = serializers.IntegerField(source='estimated_duration')
@@ -122,6 +276,8 @@ class WorkoutSerializer(serializers.ModelSerializer):
                   'estimated_calories', 'calories_estimate', 'workout_type',
                   'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        aliases = ['name', 'duration', 'calories_estimate']
+        method_sources = {'id': ['_id'], 'workout_type': ['difficulty_level']}
     
     def get_id(self, obj):
         """Convert ObjectId to string"""
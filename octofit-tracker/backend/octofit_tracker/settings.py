@@ -64,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'octofit_tracker.request_metrics.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'octofit_tracker.urls'
@@ -90,14 +91,98 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# Raw pymongo code shares one MongoClient per process (see
+# octofit_tracker/mongo.py); djongo opens one per thread, kept across
+# requests by CONN_MAX_AGE. Size the pool for the number of threads each
+# worker process runs.
+
+def _write_concern(value):
+    return int(value) if value.isdigit() else value
+
+
+MONGO_CLIENT = {
+    'host': os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'),
+    'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+    'maxIdleTimeMS': int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000)),
+    'waitQueueTimeoutMS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    'connectTimeoutMS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'serverSelectionTimeoutMS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+    'w': _write_concern(os.environ.get('MONGO_WRITE_CONCERN', '1')),
+    'readConcernLevel': os.environ.get('MONGO_READ_CONCERN', 'local'),
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
+        'CLIENT': MONGO_CLIENT,
+        # Reuse each thread's client instead of reconnecting per request
+        'CONN_MAX_AGE': None,
     }
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Set OCTOFIT_RESPONSE_CACHE=file to share cached responses between processes
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if os.environ.get('OCTOFIT_RESPONSE_CACHE') == 'file':
+    CACHES['responses'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.response_cache',
+    }
+else:
+    CACHES['responses'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-responses',
+    }
+
+RESPONSE_CACHE = {
+    'ALIAS': 'responses',
+    'TIMEOUT': 300,
+}
+
+
+# Per-request MongoDB command metrics (Server-Timing and /api/metrics/)
+# Fraction of requests to record; 0 turns recording off
+
+REQUEST_METRICS = {
+    'SAMPLE_RATE': float(os.environ.get('OCTOFIT_METRICS_SAMPLE_RATE', 1.0)),
+}
+
+
+# Write-behind activity ingestion (see octofit_tracker/write_behind.py)
+# Set OCTOFIT_WRITE_BEHIND=1 to acknowledge POST /api/activities/ once the
+# activity is in the local log; MAX_BATCH activities or FLUSH_INTERVAL
+# seconds trigger the batched insert, and past MAX_PENDING waiting
+# activities requests write through to MongoDB again
+
+WRITE_BEHIND = {
+    'ENABLED': os.environ.get('OCTOFIT_WRITE_BEHIND') == '1',
+    'LOG_DIR': BASE_DIR / '.ingest_log',
+    'MAX_BATCH': int(os.environ.get('OCTOFIT_WRITE_BEHIND_MAX_BATCH', 500)),
+    'FLUSH_INTERVAL': float(os.environ.get('OCTOFIT_WRITE_BEHIND_FLUSH_INTERVAL', 0.2)),
+    'FSYNC': os.environ.get('OCTOFIT_WRITE_BEHIND_FSYNC', '1') == '1',
+    'MAX_PENDING': 50000,
+}
+
+
+# Idempotency-Key handling for activity POSTs (see octofit_tracker/idempotency.py)
+# TTL (seconds) is also the expiry of the idempotency_keys TTL index
+
+IDEMPOTENCY = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 24 * 60 * 60,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -139,6 +224,23 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST framework
+# application/json is encoded with orjson; clients may ask for
+# application/msgpack instead
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'octofit_tracker.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'octofit_tracker.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'octofit_tracker.renderers.MessagePackParser',
+    ],
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = [
@@ -0,0 +1,131 @@
+"""
+Deterministic synthetic users, teams and activities for capacity testing.
+
+Data is generated in chunks of whole teams. Each chunk draws from its own RNG
+seeded with ``(seed, chunk start)`` and derives ObjectIds from the seed and
+row index, so the output depends only on the seed and the requested sizes,
+never on how many worker processes built it or in which order.
+"""
+from datetime import datetime, timedelta, timezone
+import random
+
+from bson import ObjectId
+
+ACTIVITY_TYPES = {
+    # type: (minutes range, km per minute range or None, calories per minute)
+    'Running': ((20, 90), (0.12, 0.2), 11),
+    'Cycling': ((30, 150), (0.3, 0.5), 9),
+    'Swimming': ((20, 60), (0.03, 0.05), 10),
+    'Walking': ((20, 120), (0.07, 0.1), 5),
+    'Weight Training': ((30, 90), None, 6),
+    'Yoga': ((20, 75), None, 4),
+    'Boxing': ((20, 60), None, 12),
+}
+FITNESS_LEVELS = ['beginner', 'intermediate', 'advanced']
+EXERCISES = ['Squats', 'Push-ups', 'Lunges', 'Plank', 'Burpees', 'Deadlifts', 'Rows', 'Jump Rope']
+
+# ObjectId kinds keep the ids of different collections apart
+USER, TEAM, ACTIVITY, WORKOUT = 1, 2, 3, 4
+# Fixed ObjectId timestamp so ids do not depend on when the data was built
+ID_TIMESTAMP = 0x65920080  # 2024-01-01T00:00:00Z
+
+
+def object_id(seed, kind, index):
+    """Deterministic ObjectId for row ``index`` of ``kind``"""
+    return ObjectId(f'{ID_TIMESTAMP:08x}{kind:02x}{seed & 0xffffff:06x}{index:08x}')
+
+
+def anchor_time():
+    """Midnight UTC today, as naive UTC; activities spread over the year before it"""
+    now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return now.replace(tzinfo=None)
+
+
+def build_chunk(seed, first_user, user_count, activities_per_user, team_size, anchor):
+    """
+    Build the documents for users ``first_user .. first_user + user_count``.
+
+    ``first_user`` and ``user_count`` must be multiples of ``team_size`` so
+    every team's members, and therefore its total, fall in one chunk.
+    Returns ``(users, teams, activities)`` lists of raw documents with
+    ``total_points`` already filled in.
+    """
+    rng = random.Random(f'{seed}:{first_user}')
+    users, teams, activities = [], [], []
+
+    for user_index in range(first_user, first_user + user_count):
+        user_id = object_id(seed, USER, user_index)
+        joined = anchor - timedelta(days=rng.randint(30, 1000))
+        total_points = 0
+        for n in range(activities_per_user):
+            activity_type = rng.choice(list(ACTIVITY_TYPES))
+            (low, high), pace, calories_per_minute = ACTIVITY_TYPES[activity_type]
+            duration = rng.randint(low, high)
+            distance = round(duration * rng.uniform(*pace), 2) if pace else None
+            # Same rule as Activity.calculate_points
+            points = duration + int(distance or 0)
+            total_points += points
+            activities.append({
+                '_id': object_id(seed, ACTIVITY, user_index * activities_per_user + n),
+                'user_id': str(user_id),
+                'activity_type': activity_type,
+                'duration': duration,
+                'distance': distance,
+                'calories': int(duration * calories_per_minute * rng.uniform(0.8, 1.2)),
+                'points': points,
+                'notes': '',
+                'created_at': anchor - timedelta(seconds=rng.randint(0, 365 * 86400)),
+            })
+        users.append({
+            '_id': user_id,
+            'username': f'athlete{user_index}',
+            'email': f'athlete{user_index}@octofit.test',
+            'first_name': 'Athlete',
+            'last_name': str(user_index),
+            'fitness_level': rng.choice(FITNESS_LEVELS),
+            'total_points': total_points,
+            'created_at': joined,
+            'updated_at': joined,
+        })
+
+    for offset in range(0, user_count, team_size):
+        members = users[offset:offset + team_size]
+        team_index = (first_user + offset) // team_size
+        created = min(member['created_at'] for member in members)
+        teams.append({
+            '_id': object_id(seed, TEAM, team_index),
+            'name': f'Team {team_index}',
+            'description': 'Synthetic team',
+            'captain_id': str(members[0]['_id']),
+            'member_ids': [str(member['_id']) for member in members],
+            'total_points': sum(member['total_points'] for member in members),
+            'created_at': created,
+            'updated_at': created,
+        })
+
+    return users, teams, activities
+
+
+def build_workouts(seed, count, anchor):
+    """Build ``count`` workout documents spread over every difficulty level"""
+    rng = random.Random(f'{seed}:workouts')
+    workouts = []
+    for index in range(count):
+        level = FITNESS_LEVELS[index % len(FITNESS_LEVELS)]
+        created = anchor - timedelta(days=rng.randint(0, 365))
+        workouts.append({
+            '_id': object_id(seed, WORKOUT, index),
+            'title': f'Workout {index}',
+            'description': 'Synthetic workout',
+            'difficulty_level': level,
+            'target_fitness_levels': rng.sample(FITNESS_LEVELS, rng.randint(1, len(FITNESS_LEVELS))),
+            'exercises': [
+                {'name': name, 'sets': rng.randint(2, 5), 'reps': rng.randint(8, 20)}
+                for name in rng.sample(EXERCISES, 4)
+            ],
+            'estimated_duration': rng.randint(15, 90),
+            'estimated_calories': rng.randint(100, 800),
+            'created_at': created,
+            'updated_at': created,
+        })
+    return workouts
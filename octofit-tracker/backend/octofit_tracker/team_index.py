@@ -0,0 +1,33 @@
+"""
+Reverse lookups from a member id to the teams it belongs to.
+
+``teams.member_ids`` holds user id strings, so the multikey index on it
+(declared in ``indexes``) lets MongoDB maintain the member -> team mapping
+as memberships change; every lookup here is a single indexed query.
+"""
+from .models import Team
+from .mongo import as_model, get_db
+from .repository import teams_by_member
+
+
+def team_names_by_member(user_ids, db=None):
+    """Map each user id to the name of the first team it belongs to"""
+    user_ids = [user_id for user_id in set(user_ids) if user_id]
+    if not user_ids:
+        return {}
+    db = db if db is not None else get_db()
+    teams = db.teams.find(
+        {'member_ids': {'$in': user_ids}}, {'name': 1, 'member_ids': 1}
+    ).sort('_id', 1)
+    wanted = set(user_ids)
+    names = {}
+    for team in teams:
+        for member_id in team.get('member_ids') or []:
+            if member_id in wanted:
+                names.setdefault(member_id, team.get('name'))
+    return names
+
+
+def teams_for_member(user_id, db=None):
+    """Return the Team instances that list ``user_id`` as a member"""
+    return [as_model(Team, team) for team in teams_by_member(user_id).find(db=db)]
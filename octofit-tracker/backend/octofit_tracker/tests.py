@@ -1,8 +1,53 @@
-from django.test import TestCase
-from rest_framework.test import APITestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+import io
+from io import StringIO
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from unittest import mock
+import uuid
+
+from asgiref.sync import async_to_sync
+from bson import ObjectId, decode_all
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from pymongo.errors import BulkWriteError
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import repository, write_behind
+from .async_views import _in_thread
+from .benchmarking import compare_results
+from .fast_serializers import compile_rows
+from .idempotency import STALE_CLAIM, ResponseCache, claim, local_cache
+from .indexes import diff_indexes
+from .leaderboard import rebuild as rebuild_leaderboards
 from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import date
+from .mongo import as_model, get_client, get_db
+from .renderers import MessagePackParser, MessagePackRenderer, ORJSONRenderer
+from .request_metrics import route_metrics
+from .rollups import rebuild as rebuild_rollups
+from .serializers import (
+    ActivitySerializer, LeaderboardSerializer, TeamSerializer, UserSerializer, WorkoutSerializer
+)
+from .synthetic import anchor_time, build_chunk, build_workouts
+from .workout_index import CHECK_INTERVAL, workout_catalog
+from .write_behind import DEAD_LETTER, WriteBehindBuffer, replay, store
+
+
+def json_roundtrip(data):
+    """``data`` as it comes back from a JSON response"""
+    return json.loads(json.dumps(data, cls=JSONEncoder))
 
 
 class UserModelTest(TestCase):
@@ -125,6 +170,25 @@ class UserAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(User.objects.count(), 1)
         self.assertEqual(User.objects.get().username, 'newuser')
+    
+    def test_list_and_teams_use_member_index(self):
+        """Test that team names and a user's teams come from member_ids"""
+        alice = User.objects.create(
+            username='alice', email='alice@example.com', first_name='Alice', last_name='A'
+        )
+        bob = User.objects.create(
+            username='bob', email='bob@example.com', first_name='Bob', last_name='B'
+        )
+        Team.objects.create(name='Red', captain_id=str(alice._id), member_ids=[str(alice._id)])
+        
+        response = self.client.get('/api/users/')
+        team_names = {u['username']: u['team_name'] for u in response.data['results']}
+        self.assertEqual(team_names, {'alice': 'Red', 'bob': None})
+        
+        response = self.client.get(f'/api/users/{alice._id}/teams/')
+        self.assertEqual([t['name'] for t in response.data], ['Red'])
+        response = self.client.get(f'/api/users/{bob._id}/teams/')
+        self.assertEqual(response.data, [])
 
 
 class TeamAPITest(APITestCase):
@@ -140,6 +204,50 @@ class TeamAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Team.objects.count(), 1)
         self.assertEqual(Team.objects.get().name, 'API Team')
+    
+    def test_add_and_remove_members(self):
+        """Test single and batch membership updates"""
+        team = Team.objects.create(name='Crew', captain_id='1', member_ids=['1'])
+        url = f'/api/teams/{team._id}/'
+        
+        response = self.client.post(url + 'add_member/', {'user_id': '2'}, format='json')
+        self.assertEqual(response.data['member_count'], 2)
+        response = self.client.post(url + 'add_member/', {'user_ids': ['2', '3', '4']}, format='json')
+        self.assertEqual(response.data['member_count'], 4)
+        response = self.client.post(url + 'remove_member/', {'user_ids': ['1', '3']}, format='json')
+        self.assertEqual(Team.objects.get(_id=team._id).member_ids, ['2', '4'])
+        
+        response = self.client.post(url + 'add_member/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url + 'add_member/', ['2'], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url + 'add_member/', {'user_ids': [{'a': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user_ids', response.data)
+        
+        # Form posts repeat the field for each id
+        response = self.client.post(
+            url + 'add_member/', 'user_ids=5&user_ids=6', content_type='application/x-www-form-urlencoded'
+        )
+        self.assertEqual(Team.objects.get(_id=team._id).member_ids, ['2', '4', '5', '6'])
+        response = self.client.post('/api/teams/not-an-id/add_member/', {'user_id': '2'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_concurrent_joins_are_not_lost(self):
+        """Test that members joining at the same time all end up on the team"""
+        team = Team.objects.create(name='Crowd', captain_id='0', member_ids=[])
+        
+        def join(user_id):
+            try:
+                from rest_framework.test import APIClient
+                APIClient().post(f'/api/teams/{team._id}/add_member/', {'user_id': user_id}, format='json')
+            finally:
+                connection.close()
+        
+        user_ids = [str(n) for n in range(50)]
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            list(pool.map(join, user_ids))
+        self.assertEqual(sorted(Team.objects.get(_id=team._id).member_ids), sorted(user_ids))
 
 
 class ActivityAPITest(APITestCase):
@@ -156,9 +264,118 @@ class ActivityAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Activity.objects.count(), 1)
         self.assertEqual(Activity.objects.get().activity_type, 'cycling')
+    
+    def test_list_resolves_user_names_in_one_lookup(self):
+        """Test that listing activities does not query users once per row"""
+        user = User.objects.create(
+            username='runner', email='runner@example.com', first_name='R', last_name='U'
+        )
+        for _ in range(3):
+            Activity.objects.create(user_id=str(user._id), activity_type='running', duration=10)
+        Activity.objects.create(user_id='123', activity_type='yoga', duration=10)
+        
+        response = self.client.get('/api/activities/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(a['user_name'] for a in response.data['results']),
+            ['Unknown User', 'runner', 'runner', 'runner']
+        )
+        commands = re.search(r'desc="(\d+) commands"', response['Server-Timing']).group(1)
+        
+        # Names come from one $in lookup, so more users cost no more MongoDB commands
+        for n in range(3):
+            other = User.objects.create(username=f'walker{n}', email=f'walker{n}@example.com')
+            Activity.objects.create(user_id=str(other._id), activity_type='walking', duration=10)
+        response = self.client.get('/api/activities/')
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIn(f'desc="{commands} commands"', response['Server-Timing'])
+    
+    def test_list_pages_with_keyset_cursor(self):
+        """Test that following next/previous links walks every activity once"""
+        for minutes in range(5):
+            Activity.objects.create(user_id='123', activity_type='running', duration=minutes)
+        expected = [str(a._id) for a in Activity.objects.order_by('-created_at', '-_id')]
+        
+        seen = []
+        url = '/api/activities/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [a['id'] for a in response.data['results']]
+            last_page = response.data
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+        
+        response = self.client.get(last_page['previous'])
+        self.assertEqual([a['id'] for a in response.data['results']], expected[2:4])
+    
+    def test_list_skips_activities_without_created_at(self):
+        """Test that rows the keyset cursor cannot reach are left out of every page"""
+        Activity.objects.create(user_id='123', activity_type='running', duration=10)
+        get_db().activities.insert_one({'user_id': '123', 'activity_type': 'yoga', 'duration': 5, 'created_at': None})
+        for params in ({'page_size': '1'}, {'page_size': '1', 'user_id': '123'}):
+            response = self.client.get('/api/activities/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([a['activity_type'] for a in response.data['results']], ['running'])
+            self.assertIsNone(response.data['next'])
+    
+    def test_export_streams_ndjson_and_csv(self):
+        """Test that the export action streams filtered activities"""
+        Activity.objects.create(user_id='123', activity_type='running', duration=30, points=5)
+        Activity.objects.create(user_id='456', activity_type='yoga', duration=20)
+        
+        response = self.client.get('/api/activities/export/?user_id=123')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['activity_type'], 'running')
+        
+        response = self.client.get('/api/activities/export/?output=csv&end=2000-01-01')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'id,user_id,activity_type,duration,distance,calories,points,notes,created_at'
+        ])
+    
+    def test_export_rejects_bad_parameters(self):
+        """Test that unknown formats and dates return 400"""
+        response = self.client.get('/api/activities/export/?output=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/activities/export/?start=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_bulk_create_reports_errors_per_item(self):
+        """Test that bulk ingest writes valid items and reports invalid ones"""
+        data = [
+            {'user_id': '123', 'activity_type': 'running', 'duration': 30, 'distance': 5.2},
+            {'user_id': '123', 'activity_type': 'running'},
+            {'user_id': '456', 'activity_type': 'yoga', 'duration': 15},
+        ]
+        response = self.client.post('/api/activities/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertIn('duration', response.data['results'][1]['errors'])
+        self.assertEqual(Activity.objects.count(), 2)
+        self.assertEqual(
+            sorted(Activity.objects.values_list('points', flat=True)), [15, 35]
+        )
+    
+    def test_bulk_create_requires_a_list(self):
+        """Test that a non-list body is rejected"""
+        response = self.client.post('/api/activities/bulk/', {'user_id': '123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_invalid_cursor_returns_404(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get('/api/activities/?cursor=cD1nYXJiYWdl')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
 class WorkoutAPITest(APITestCase):
+    def setUp(self):
+        caches['responses'].clear()
+    
     def test_create_workout(self):
         """Test creating a workout via API"""
         data = {
@@ -174,3 +391,784 @@ class WorkoutAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Workout.objects.count(), 1)
         self.assertEqual(Workout.objects.get().title, 'HIIT Session')
+    
+    def test_list_supports_conditional_get(self):
+        """Test ETag caching of workout lists and invalidation on write"""
+        Workout.objects.create(
+            title='Yoga', description='Stretch', difficulty_level='beginner',
+            target_fitness_levels=['beginner'], exercises=[],
+            estimated_duration=20, estimated_calories=100
+        )
+        first = self.client.get('/api/workouts/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        etag = first['ETag']
+        
+        second = self.client.get('/api/workouts/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        for header in (f'"other", W/{etag}', '*'):
+            response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Containing the ETag is not listing it
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=f'"v{etag}"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        self.client.post('/api/workouts/', {
+            'title': 'Run', 'description': 'Go', 'difficulty_level': 'beginner',
+            'target_fitness_levels': ['beginner'], 'exercises': [],
+            'estimated_duration': 30, 'estimated_calories': 300
+        }, format='json')
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 2)
+        
+        stats = self.client.get('/api/cache-stats/').data
+        self.assertGreater(stats['hit_rate'], 0)
+    
+    def test_conditional_get_sees_writes_after_cache_expiry(self):
+        """Test that writes the version counters miss stop 304s once cached entries expire"""
+        config = {**settings.RESPONSE_CACHE, 'TIMEOUT': 0}
+        with override_settings(RESPONSE_CACHE=config):
+            etag = self.client.get('/api/workouts/')['ETag']
+            # Written without bumping the workouts version, like populate_db
+            get_db().workouts.insert_one({'title': 'Swim', 'difficulty_level': 'beginner'})
+            response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class LeaderboardAPITest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create(
+            username='alice', email='alice@example.com', first_name='Alice', last_name='A'
+        )
+        self.bob = User.objects.create(
+            username='bob', email='bob@example.com', first_name='Bob', last_name='B'
+        )
+        for points in (10, 20):
+            Activity.objects.create(user_id=str(self.alice._id), activity_type='running',
+                                    duration=30, points=points)
+        Activity.objects.create(user_id=str(self.bob._id), activity_type='cycling',
+                                duration=60, points=50)
+        Activity.objects.create(user_id='not-a-user', activity_type='yoga',
+                                duration=15, points=500)
+    
+    def test_list_ranks_users_by_points(self):
+        """Test that the leaderboard is aggregated per user and sorted by points"""
+        response = self.client.get('/api/leaderboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'id': str(self.bob._id), 'user': str(self.bob._id), 'user_name': 'bob',
+             'total_points': 50, 'total_activities': 1},
+            {'id': str(self.alice._id), 'user': str(self.alice._id), 'user_name': 'alice',
+             'total_points': 30, 'total_activities': 2},
+        ])
+    
+    def test_activity_writes_update_materialized_leaderboard(self):
+        """Test that creating and deleting activities updates stored rankings"""
+        self.client.get('/api/leaderboard/?period=weekly')
+        response = self.client.post('/api/activities/', {
+            'user_id': str(self.bob._id), 'activity_type': 'running', 'duration': 20,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        rankings = self.client.get('/api/leaderboard/?period=weekly').data
+        self.assertEqual(rankings[0]['user_name'], 'bob')
+        self.assertEqual(rankings[0]['total_activities'], 2)
+        
+        self.client.delete(f"/api/activities/{response.data['id']}/")
+        rankings = self.client.get('/api/leaderboard/?period=weekly').data
+        self.assertEqual(rankings[0]['total_activities'], 1)
+    
+    def test_write_before_first_read_keeps_full_rankings(self):
+        """Test that an activity written before any leaderboard read does not replace the rankings"""
+        response = self.client.post('/api/activities/', {
+            'user_id': str(self.alice._id), 'activity_type': 'running', 'duration': 5,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        rankings = self.client.get('/api/leaderboard/').data
+        self.assertEqual([row['user_name'] for row in rankings], ['bob', 'alice'])
+        self.assertEqual(rankings[1]['total_activities'], 3)
+    
+    def test_rebuild_writes_every_period(self):
+        """Test that a rebuild stores weekly, monthly and all-time leaderboards"""
+        rebuild_leaderboards()
+        self.assertEqual(
+            sorted(Leaderboard.objects.values_list('period', flat=True)),
+            ['all-time', 'monthly', 'weekly']
+        )
+    
+    def test_unknown_period_is_rejected(self):
+        """Test that an unsupported period returns 400"""
+        response = self.client.get('/api/leaderboard/?period=daily')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_limit_returns_top_entries(self):
+        """Test that ?limit= keeps only the highest ranked users"""
+        response = self.client.get('/api/leaderboard/', {'limit': 1})
+        self.assertEqual([row['user_name'] for row in response.data], ['bob'])
+        response = self.client.get('/api/leaderboard/', {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_custom_range_ranks_from_rollups(self):
+        """Test that start/end rank users over a custom range of days"""
+        rebuild_rollups()
+        today = datetime.now(timezone.utc).date()
+        response = self.client.get('/api/leaderboard/', {
+            'start': str(today), 'end': str(today + timedelta(days=1)), 'limit': 2,
+        })
+        self.assertEqual([row['total_points'] for row in response.data], [50, 30])
+        response = self.client.get('/api/leaderboard/', {'end': str(today - timedelta(days=1))})
+        self.assertEqual(response.data, [])
+
+
+class EnsureIndexesCommandTest(TestCase):
+    def test_indexes_are_created_idempotently_and_used(self):
+        """Test that ensure_indexes creates every index once and queries use them"""
+        call_command('ensure_indexes', stdout=StringIO())
+        self.assertNotIn('missing', [status for _, status, _, _ in diff_indexes()])
+        
+        out = StringIO()
+        call_command('ensure_indexes', '--check', stdout=out)
+        self.assertNotIn('created', out.getvalue())
+        self.assertIn('No viewset query scans a whole collection', out.getvalue())
+
+
+class TotalPointsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='walker', email='walker@example.com', first_name='W', last_name='K'
+        )
+        self.user_id = str(self.user._id)
+        self.team = Team.objects.create(name='Walkers', captain_id=self.user_id, member_ids=[self.user_id])
+    
+    def test_activity_writes_maintain_user_and_team_totals(self):
+        """Test that totals follow activity creates and deletes"""
+        response = self.client.post('/api/activities/', {
+            'user_id': self.user_id, 'activity_type': 'walking', 'duration': 40, 'distance': 3.5,
+        }, format='json')
+        self.assertEqual(User.objects.get(_id=self.user._id).total_points, 43)
+        self.assertEqual(Team.objects.get(_id=self.team._id).total_points, 43)
+        
+        self.client.delete(f"/api/activities/{response.data['id']}/")
+        self.assertEqual(User.objects.get(_id=self.user._id).total_points, 0)
+        self.assertEqual(Team.objects.get(_id=self.team._id).total_points, 0)
+    
+    def test_activity_updates_reaward_points(self):
+        """Test that editing duration or distance recomputes points and totals"""
+        response = self.client.post('/api/activities/', {
+            'user_id': self.user_id, 'activity_type': 'walking', 'duration': 40, 'distance': 3.5,
+        }, format='json')
+        response = self.client.patch(f"/api/activities/{response.data['id']}/", {'duration': 60}, format='json')
+        self.assertEqual(response.data['points'], 63)
+        self.assertEqual(User.objects.get(_id=self.user._id).total_points, 63)
+        self.assertEqual(Team.objects.get(_id=self.team._id).total_points, 63)
+    
+    def test_membership_changes_move_member_points(self):
+        """Test that joining and leaving a team adds and removes the member's points"""
+        other = Team.objects.create(name='Others', captain_id='x', member_ids=[])
+        self.client.post('/api/activities/', {
+            'user_id': self.user_id, 'activity_type': 'walking', 'duration': 10,
+        }, format='json')
+        
+        response = self.client.post(f'/api/teams/{other._id}/add_member/', {'user_id': self.user_id}, format='json')
+        self.assertEqual(response.data['total_points'], 10)
+        response = self.client.post(f'/api/teams/{other._id}/add_member/', {'user_id': self.user_id}, format='json')
+        self.assertEqual(response.data['total_points'], 10)
+        response = self.client.post(f'/api/teams/{other._id}/remove_member/', {'user_id': self.user_id}, format='json')
+        self.assertEqual(response.data['total_points'], 0)
+        
+        ranking = self.client.get('/api/leaderboard/teams/').data
+        self.assertEqual([team['name'] for team in ranking], ['Walkers', 'Others'])
+    
+    def test_team_writes_count_existing_member_points(self):
+        """Test that creating or editing a team's members carries their points"""
+        self.client.post('/api/activities/', {
+            'user_id': self.user_id, 'activity_type': 'walking', 'duration': 30,
+        }, format='json')
+        response = self.client.post('/api/teams/', {
+            'name': 'Newcomers', 'captain_id': self.user_id, 'member_ids': [self.user_id],
+        }, format='json')
+        self.assertEqual(response.data['total_points'], 30)
+        team_id = response.data['id']
+        self.assertEqual(Team.objects.get(name='Newcomers').total_points, 30)
+        
+        response = self.client.patch(f'/api/teams/{team_id}/', {'member_ids': []}, format='json')
+        self.assertEqual(response.data['total_points'], 0)
+        self.assertEqual(Team.objects.get(name='Newcomers').total_points, 0)
+    
+    def test_reconcile_fixes_drift(self):
+        """Test that reconcile_totals recomputes totals from activities"""
+        Activity.objects.create(user_id=self.user_id, activity_type='walking', duration=10, points=25)
+        
+        call_command('reconcile_totals', stdout=StringIO())
+        self.assertEqual(User.objects.get(_id=self.user._id).total_points, 25)
+        self.assertEqual(Team.objects.get(_id=self.team._id).total_points, 25)
+        
+        out = StringIO()
+        call_command('reconcile_totals', '--dry-run', stdout=out)
+        self.assertIn('Found drift in 0 users and 0 teams', out.getvalue())
+
+
+class AsyncDashboardTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='dash', email='dash@example.com', first_name='D', last_name='A'
+        )
+        self.user_id = str(self.user._id)
+        Team.objects.create(name='Dashers', captain_id=self.user_id, member_ids=[self.user_id])
+        Activity.objects.create(user_id=self.user_id, activity_type='running', duration=30, points=30)
+    
+    def test_dashboard_combines_concurrent_lookups(self):
+        """Test that the async dashboard returns user, activities, teams and rankings"""
+        response = self.client.get(f'/api/async/users/{self.user_id}/dashboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['user']['username'], 'dash')
+        self.assertEqual(data['user']['team_name'], 'Dashers')
+        self.assertEqual([a['activity_type'] for a in data['activities']], ['running'])
+        self.assertEqual([t['name'] for t in data['teams']], ['Dashers'])
+        self.assertEqual(data['leaderboard'][0]['user_name'], 'dash')
+    
+    def test_async_endpoints_match_sync_ones(self):
+        """Test that the async user endpoints return the same data as the viewsets"""
+        for suffix in ('', 'activities/', 'teams/'):
+            sync = self.client.get(f'/api/users/{self.user_id}/{suffix}').json()
+            response = self.client.get(f'/api/async/users/{self.user_id}/{suffix}')
+            self.assertEqual(response.json(), sync)
+    
+    def test_async_activities_page_like_the_sync_action(self):
+        """Test that following the async activities cursor walks every activity once"""
+        for minutes in range(4):
+            Activity.objects.create(user_id=self.user_id, activity_type='walking', duration=minutes)
+        expected = [a['id'] for a in self.client.get(f'/api/users/{self.user_id}/activities/').json()['results']]
+        seen = []
+        url = f'/api/async/users/{self.user_id}/activities/?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            seen += [a['id'] for a in page['results']]
+            url = page['next']
+        self.assertEqual(seen, expected)
+        response = self.client.get(f'/api/async/users/{self.user_id}/activities/?cursor=cD1nYXJiYWdl')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_unknown_user_returns_404(self):
+        """Test that missing users are reported as not found"""
+        response = self.client.get('/api/async/users/000000000000000000000000/dashboard/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MongoPoolTest(APITestCase):
+    def test_requests_and_async_views_share_one_client(self):
+        """Test that raw queries use one pooled client across requests and threads"""
+        client = get_client()
+        user = User.objects.create(username='pool', email='pool@example.com')
+        self.client.get('/api/users/')
+        self.client.get(f'/api/users/{user._id}/activities/')
+        self.client.get(f'/api/async/users/{user._id}/dashboard/')
+        self.assertIs(get_client(), client)
+        self.assertIs(async_to_sync(_in_thread(lambda: get_db().client))(), client)
+    
+    def test_pool_stats_report_checkouts(self):
+        """Test that pool checkouts are recorded and exposed"""
+        get_db().users.find_one()
+        stats = self.client.get('/api/pool-stats/').data
+        self.assertGreater(stats['checkouts'], 0)
+        self.assertGreater(stats['open_connections'], 0)
+        self.assertEqual(stats['max_pool_size'], 100)
+
+
+class SyntheticDataTest(TestCase):
+    def test_chunks_are_deterministic(self):
+        """Test that the same seed builds identical documents"""
+        anchor = anchor_time()
+        self.assertEqual(build_chunk(7, 10, 10, 3, 5, anchor), build_chunk(7, 10, 10, 3, 5, anchor))
+        self.assertNotEqual(build_chunk(7, 10, 10, 3, 5, anchor), build_chunk(8, 10, 10, 3, 5, anchor))
+    
+    def test_totals_match_activities(self):
+        """Test that precomputed user and team totals agree with the activities"""
+        users, teams, activities = build_chunk(1, 0, 10, 4, 5, anchor_time())
+        self.assertEqual(len(activities), 40)
+        for user in users:
+            points = sum(a['points'] for a in activities if a['user_id'] == str(user['_id']))
+            self.assertEqual(user['total_points'], points)
+        self.assertEqual(len(teams), 2)
+        self.assertEqual(sum(team['total_points'] for team in teams), sum(a['points'] for a in activities))
+
+
+class BenchmarkCompareTest(TestCase):
+    def test_regressions_are_reported(self):
+        """Test that slower or chattier endpoints are flagged against a baseline"""
+        baseline = {'datasets': {'1000': {'endpoints': {
+            'users.list': {'p95_ms': 10.0, 'queries': 2},
+            'teams.list': {'p95_ms': 10.0, 'queries': 2},
+        }}}}
+        current = {'datasets': {'1000': {'endpoints': {
+            'users.list': {'p95_ms': 11.0, 'queries': 2},
+            'teams.list': {'p95_ms': 15.0, 'queries': 3},
+        }}}}
+        regressions = compare_results(baseline, current, tolerance=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all('teams.list' in line for line in regressions))
+
+
+class RequestMetricsTest(APITestCase):
+    def setUp(self):
+        route_metrics.reset()
+        User.objects.create(username='metrics', email='metrics@example.com')
+    
+    def test_server_timing_header(self):
+        """Test that responses report their database commands in Server-Timing"""
+        response = self.client.get('/api/users/')
+        self.assertIn('Server-Timing', response)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* commands"')
+    
+    def test_metrics_are_grouped_by_route(self):
+        """Test that /api/metrics/ aggregates requests per route"""
+        self.client.get('/api/users/')
+        self.client.get('/api/users/')
+        metrics = self.client.get('/api/metrics/').data
+        self.assertEqual(metrics['GET user-list']['requests'], 2)
+        self.assertGreater(metrics['GET user-list']['commands']['mean'], 0)
+    
+    def test_streamed_commands_are_recorded_when_the_body_ends(self):
+        """Test that commands run while a streaming response is consumed are counted"""
+        route_metrics.reset()
+        Activity.objects.create(user_id='123', activity_type='running', duration=30)
+        response = self.client.get('/api/activities/export/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('GET activity-export', route_metrics.snapshot())
+        b''.join(response.streaming_content)
+        metrics = route_metrics.snapshot()['GET activity-export']
+        self.assertEqual(metrics['requests'], 1)
+        self.assertGreater(metrics['commands']['max'], 0)
+    
+    def test_sampling_off_skips_recording(self):
+        """Test that a zero sample rate leaves responses and metrics untouched"""
+        with self.settings(REQUEST_METRICS={'SAMPLE_RATE': 0}):
+            response = self.client.get('/api/users/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/api/metrics/').data.get('GET user-list'), None)
+
+
+class SparseFieldsTest(APITestCase):
+    def setUp(self):
+        caches['responses'].clear()
+        self.user = User.objects.create(username='sparse', email='sparse@example.com')
+        Activity.objects.create(user_id=str(self.user._id), activity_type='Running', duration=30, calories=200)
+        Workout.objects.create(
+            title='Yoga', description='Stretch', difficulty_level='beginner',
+            target_fitness_levels=['beginner'], exercises=[],
+            estimated_duration=20, estimated_calories=100
+        )
+    
+    def test_fields_limits_output(self):
+        """Test that ?fields= returns only the requested fields"""
+        response = self.client.get('/api/activities/', {'fields': 'id,user_name,duration'})
+        row = response.data['results'][0]
+        self.assertEqual(set(row), {'id', 'user_name', 'duration'})
+        self.assertEqual(row['user_name'], 'sparse')
+    
+    def test_unrequested_method_fields_are_not_computed(self):
+        """Test that dropping user_name skips the user lookup"""
+        route_metrics.reset()
+        self.client.get('/api/activities/', {'fields': 'id,duration'})
+        sparse = route_metrics.snapshot()['GET activity-list']['commands']['max']
+        route_metrics.reset()
+        self.client.get('/api/activities/')
+        full = route_metrics.snapshot()['GET activity-list']['commands']['max']
+        self.assertLess(sparse, full)
+    
+    def test_compact_drops_aliases(self):
+        """Test that ?compact=1 removes duplicate alias fields"""
+        activity = self.client.get('/api/activities/', {'compact': '1'}).data['results'][0]
+        self.assertNotIn('calories_burned', activity)
+        self.assertNotIn('date', activity)
+        self.assertEqual(activity['calories'], 200)
+        workout = self.client.get('/api/workouts/', {'compact': '1'}).data[0]
+        self.assertEqual(workout['title'], 'Yoga')
+        for alias in ('name', 'duration', 'calories_estimate'):
+            self.assertNotIn(alias, workout)
+    
+    def test_unknown_field_is_rejected(self):
+        """Test that unknown field names return 400"""
+        response = self.client.get('/api/users/', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityStatsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='stats', email='stats@example.com')
+        self.team = Team.objects.create(name='Stats Team', member_ids=[str(self.user._id)])
+        for activity_type, duration, calories in (('Running', 30, 300), ('Yoga', 20, 80)):
+            self.client.post('/api/activities/', {
+                'user_id': str(self.user._id),
+                'activity_type': activity_type,
+                'duration': duration,
+                'calories': calories,
+            }, format='json')
+    
+    def test_user_stats_follow_writes(self):
+        """Test that daily user stats include new activities and drop deleted ones"""
+        rows = self.client.get(f'/api/users/{self.user._id}/stats/').data
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['duration'], 50)
+        self.assertEqual(rows[0]['calories'], 380)
+        self.assertEqual(rows[0]['activities'], 2)
+        
+        activity_id = self.client.get('/api/activities/', {'user_id': str(self.user._id)}).data['results'][0]['id']
+        self.client.delete(f'/api/activities/{activity_id}/')
+        rows = self.client.get(f'/api/users/{self.user._id}/stats/', {'bucket': 'week'}).data
+        self.assertEqual(rows[0]['activities'], 1)
+    
+    def test_rebuild_matches_incremental_rollups(self):
+        """Test that rebuilding the rollups reproduces the incremental totals"""
+        before = self.client.get(f'/api/teams/{self.team._id}/stats/', {'bucket': 'month'}).data
+        rebuild_rollups()
+        after = self.client.get(f'/api/teams/{self.team._id}/stats/', {'bucket': 'month'}).data
+        self.assertEqual(after, before)
+        self.assertEqual(after[0]['points'], 50)
+    
+    def test_invalid_bucket_returns_400(self):
+        """Test that unknown buckets are rejected"""
+        response = self.client.get(f'/api/users/{self.user._id}/stats/', {'bucket': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WorkoutRecommendationTest(APITestCase):
+    def setUp(self):
+        caches['responses'].clear()
+        self.cardio = Workout.objects.create(
+            title='Speed Cardio', description='Sprint intervals', difficulty_level='intermediate',
+            target_fitness_levels=['beginner'], exercises=[{'name': 'Sprint Intervals'}],
+            estimated_duration=30, estimated_calories=400
+        )
+        self.yoga = Workout.objects.create(
+            title='Flexibility Flow', description='Stretch it out', difficulty_level='beginner',
+            target_fitness_levels=['beginner'], exercises=[{'name': 'Yoga Flow'}],
+            estimated_duration=20, estimated_calories=100
+        )
+        self.user = User.objects.create(username='yogi', email='yogi@example.com')
+    
+    def test_ranked_by_recent_activity_mix(self):
+        """Test that workouts matching the user's activities come first"""
+        for _ in range(2):
+            Activity.objects.create(user_id=str(self.user._id), activity_type='Yoga', duration=30)
+        response = self.client.get('/api/workouts/recommended/', {'user_id': str(self.user._id)})
+        self.assertEqual([w['title'] for w in response.data], ['Flexibility Flow', 'Speed Cardio'])
+    
+    def test_index_follows_workout_writes(self):
+        """Test that created workouts show up without a restart"""
+        self.client.get('/api/workouts/recommended/')
+        self.client.post('/api/workouts/', {
+            'title': 'Beginner Walk', 'description': 'Easy', 'difficulty_level': 'beginner',
+            'target_fitness_levels': ['beginner'], 'exercises': [],
+            'estimated_duration': 30, 'estimated_calories': 120,
+        }, format='json')
+        response = self.client.get('/api/workouts/recommended/', {'difficulty_level': 'beginner'})
+        self.assertEqual([w['title'] for w in response.data], ['Flexibility Flow', 'Beginner Walk'])
+    
+    def test_index_refreshes_after_out_of_band_writes(self):
+        """Test that workouts written outside the viewsets show up after the next check"""
+        self.client.get('/api/workouts/recommended/')
+        get_db().workouts.insert_one({
+            'title': 'Imported Walk', 'description': 'Easy', 'difficulty_level': 'beginner',
+            'target_fitness_levels': ['beginner'], 'exercises': [],
+            'estimated_duration': 30, 'estimated_calories': 120,
+        })
+        workout_catalog._checked -= CHECK_INTERVAL
+        response = self.client.get('/api/workouts/recommended/', {'difficulty_level': 'beginner'})
+        self.assertEqual([w['title'] for w in response.data], ['Flexibility Flow', 'Imported Walk'])
+    
+    def test_served_from_memory(self):
+        """Test that a warm index answers without querying workouts"""
+        self.client.get('/api/workouts/recommended/')
+        route_metrics.reset()
+        # A different query string misses the response cache
+        response = self.client.get('/api/workouts/recommended/', {'fitness_level': 'beginner'})
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(route_metrics.snapshot()['GET workout-recommended']['commands']['max'], 0)
+
+
+class FastSerializerParityTest(APITestCase):
+    def test_compiled_rows_match_serializers(self):
+        """Test that compiled rows render raw documents exactly like the serializers"""
+        users, teams, activities = build_chunk(3, 0, 10, 3, 5, anchor_time())
+        activities[0]['distance'] = None
+        activities[1].pop('notes')
+        activities[2]['created_at'] = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+        # Shaped like leaderboard.materialize output: dates are stored as midnight datetimes
+        entry = {'user': str(users[0]['_id']), 'user_name': users[0]['username'],
+                 'total_points': 40, 'total_activities': 2}
+        leaderboards = [
+            {
+                '_id': ObjectId(), 'period': 'weekly', 'period_start': datetime(2024, 1, 1),
+                'period_end': datetime(2024, 1, 7), 'user_rankings': [entry], 'team_rankings': [],
+                'last_updated': anchor_time(),
+            },
+            {
+                '_id': ObjectId(), 'period': 'all-time', 'period_start': datetime(1970, 1, 1),
+                'period_end': None, 'user_rankings': [], 'team_rankings': [], 'last_updated': anchor_time(),
+            },
+        ]
+        cases = [
+            (UserSerializer, User, users),
+            (TeamSerializer, Team, teams),
+            (ActivitySerializer, Activity, activities),
+            (WorkoutSerializer, Workout, build_workouts(3, 6, anchor_time())),
+            (LeaderboardSerializer, Leaderboard, leaderboards),
+        ]
+        for serializer_class, model, documents in cases:
+            # Page-level name lookups are covered by the API test below
+            fields = tuple(
+                name for name in serializer_class().fields
+                if serializer_class is LeaderboardSerializer or name not in ('user_name', 'team_name')
+            )
+            expected = []
+            for document in documents:
+                serializer = serializer_class(as_model(model, document))
+                for name in set(serializer.fields) - set(fields):
+                    serializer.fields.pop(name)
+                expected.append(serializer.data)
+            rendered = compile_rows(serializer_class, fields).render(documents)
+            self.assertEqual(
+                json.dumps(rendered, cls=JSONEncoder), json.dumps(expected, cls=JSONEncoder),
+                serializer_class.__name__,
+            )
+    
+    def test_list_endpoints_match_serializers(self):
+        """Test that fast-path list responses equal the DRF serializer output"""
+        user = User.objects.create(username='parity', email='parity@example.com')
+        Team.objects.create(name='Parity', member_ids=[str(user._id)])
+        Activity.objects.create(user_id=str(user._id), activity_type='Running', duration=30, distance=5.5)
+        Activity.objects.create(user_id='missing', activity_type='Yoga', duration=20)
+        
+        response = self.client.get('/api/activities/')
+        expected = ActivitySerializer(Activity.objects.order_by('-created_at', '-_id'), many=True).data
+        self.assertEqual(response.json()['results'], json_roundtrip(expected))
+        
+        response = self.client.get('/api/users/')
+        expected = UserSerializer(User.objects.order_by('-created_at', '-_id'), many=True).data
+        self.assertEqual(response.json()['results'], json_roundtrip(expected))
+    
+    def test_stored_leaderboards_match_serializer(self):
+        """Test that materialized leaderboard documents render the same on both paths"""
+        user = User.objects.create(username='ranked', email='ranked@example.com')
+        Activity.objects.create(user_id=str(user._id), activity_type='Running', duration=30, points=30)
+        self.client.get('/api/leaderboard/?period=weekly')
+        documents = list(get_db().leaderboard.find())
+        self.assertTrue(documents)
+        fields = tuple(LeaderboardSerializer().fields)
+        expected = [LeaderboardSerializer(as_model(Leaderboard, document)).data for document in documents]
+        rendered = compile_rows(LeaderboardSerializer, fields).render(documents)
+        self.assertEqual(json_roundtrip(rendered), json_roundtrip(expected))
+
+
+class RepositoryTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='repo', email='repo@example.com')
+        for minutes in range(5):
+            Activity.objects.create(user_id=str(self.user._id), activity_type='Running', duration=10 + minutes)
+        Activity.objects.create(user_id='someone-else', activity_type='Yoga', duration=30)
+    
+    def test_pymongo_reads_match_orm(self):
+        """Test that repository queries return the rows the ORM does"""
+        user_id = str(self.user._id)
+        orm = list(Activity.objects.filter(user_id=user_id).order_by('-created_at', '-_id').values_list('_id', flat=True))
+        native = [row['_id'] for row in repository.activities_by_user(user_id).seek(None, False, 10)]
+        self.assertEqual(native, orm)
+        names = [row['username'] for row in repository.users_by_ids([user_id, 'bad-id']).values('username')]
+        self.assertEqual(names, ['repo'])
+    
+    def test_user_activity_pages_seek_through_repository(self):
+        """Test that keyset pages over a repository query cover every activity once"""
+        seen = []
+        url = f'/api/users/{self.user._id}/activities/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+
+class RendererTest(APITestCase):
+    def test_orjson_matches_drf_json(self):
+        """Test that the orjson renderer matches DRF's JSONRenderer on API data"""
+        data = {
+            'naive': datetime(2024, 5, 1, 12, 30, 15, 123456),
+            'aware': datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc),
+            'day': date(2024, 5, 1),
+            'gap': timedelta(minutes=5),
+            'points': Decimal('1.5'),
+            'text': 'café   "quoted"',
+            'rows': [{'id': 'a', 'distance': None, 'tags': ['x', 1, 2.5, True]}],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        # Beyond 64 bits orjson gives up and DRF's encoder takes over
+        self.assertEqual(ORJSONRenderer().render({'big': 2 ** 70}), b'{"big":1180591620717411303424}')
+    
+    def test_json_requests_and_responses(self):
+        """Test that the API parses and renders application/json through orjson"""
+        response = self.client.post(
+            '/api/users/', {'username': 'orjson', 'email': 'orjson@example.com'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get('/api/users/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['results'][0]['username'], 'orjson')
+        response = self.client.post('/api/users/', b'{"username":', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_msgpack_round_trip(self):
+        """Test that MessagePack keeps ObjectIds and datetimes intact"""
+        pk = ObjectId()
+        data = {'_id': pk, 'created_at': datetime(2024, 5, 1, 12, 30), 'tags': ['a']}
+        body = MessagePackRenderer().render(data)
+        parsed = MessagePackParser().parse(io.BytesIO(body))
+        self.assertEqual(parsed['_id'], pk)
+        self.assertEqual(parsed['created_at'], datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc))
+        self.assertEqual(parsed['tags'], ['a'])
+
+
+class WriteBehindTest(APITestCase):
+    def setUp(self):
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        self.log_dir = log_dir.name
+    
+    def test_post_is_acknowledged_from_the_log(self):
+        """Test that write-behind POSTs answer 202 without MongoDB and are inserted on flush"""
+        config = {**settings.WRITE_BEHIND, 'ENABLED': True, 'LOG_DIR': self.log_dir, 'FLUSH_INTERVAL': 60}
+        with override_settings(WRITE_BEHIND=config):
+            self.addCleanup(write_behind.stop_buffer)
+            response = self.client.post(
+                '/api/activities/', {'user_id': 'u1', 'activity_type': 'Running', 'duration': 30}, format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            # Acknowledged without a single MongoDB command
+            self.assertIn('desc="0 commands"', response['Server-Timing'])
+            self.assertNotIn('user_name', response.data)
+            self.assertEqual(Activity.objects.count(), 0)
+            write_behind.get_buffer().flush()
+        self.assertEqual(str(Activity.objects.get(user_id='u1')._id), response.data['id'])
+    
+    def test_replay_stores_activities_left_by_a_crash(self):
+        """Test that replay inserts a dead process's logged activities exactly once"""
+        crashed = WriteBehindBuffer(self.log_dir)
+        for minutes in range(3):
+            crashed.append({
+                'user_id': 'u2', 'activity_type': 'Yoga', 'duration': 10 + minutes, 'distance': None,
+                'calories': None, 'points': 10, 'notes': '', 'created_at': datetime.utcnow(),
+            })
+        get_db().activities.insert_one(crashed._current.documents[0])
+        self.assertEqual(replay(self.log_dir), 0)
+        # Closing without flushing releases the lock like a dead process
+        crashed._current.file.close()
+        self.assertEqual(replay(self.log_dir), 2)
+        self.assertEqual(Activity.objects.filter(user_id='u2').count(), 3)
+        self.assertEqual(replay(self.log_dir), 0)
+    
+    def test_concurrent_appends_share_fsyncs(self):
+        """Test that appends waiting on an fsync are covered by one group commit"""
+        fsync = os.fsync
+        fsyncs = []
+        
+        def slow_fsync(fd):
+            fsyncs.append(threading.get_ident())
+            time.sleep(0.05)
+            fsync(fd)
+        
+        buffer = WriteBehindBuffer(self.log_dir)
+        with mock.patch('octofit_tracker.write_behind.os.fsync', slow_fsync):
+            with ThreadPoolExecutor(max_workers=20) as pool:
+                appended = list(pool.map(lambda n: buffer.append({'n': n}), range(20)))
+        self.assertTrue(all(appended))
+        self.assertLess(len(fsyncs), 20)
+        self.assertEqual(buffer._current.synced, 20)
+    
+    def test_rejected_activities_move_to_the_dead_letter_file(self):
+        """Test that documents MongoDB refuses are set aside instead of retried forever"""
+        documents = [{
+            '_id': ObjectId(), 'user_id': 'u3', 'duration': minutes, 'distance': None,
+            'calories': None, 'points': 10, 'created_at': None,
+        } for minutes in range(3)]
+        db = mock.MagicMock()
+        db.activities.insert_many.side_effect = BulkWriteError({'writeErrors': [
+            {'index': 0, 'code': 11000, 'errmsg': 'duplicate key'},
+            {'index': 2, 'code': 121, 'errmsg': 'Document failed validation'},
+        ]})
+        with mock.patch('octofit_tracker.write_behind.activities_changed') as changed:
+            with self.assertLogs('octofit_tracker.write_behind', 'ERROR'):
+                self.assertEqual(store(documents, db, self.log_dir), 1)
+        self.assertEqual(len(changed.call_args.args[0]), 1)
+        with open(os.path.join(self.log_dir, DEAD_LETTER), 'rb') as file:
+            self.assertEqual(decode_all(file.read()), [documents[2]])
+
+
+class IdempotencyTest(APITestCase):
+    def post(self, key, data):
+        return self.client.post('/api/activities/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+    
+    def test_retry_replays_the_first_response(self):
+        """Test that a retried POST returns the original response without a second insert"""
+        key = str(uuid.uuid4())
+        data = {'user_id': 'retry', 'activity_type': 'Running', 'duration': 30}
+        first = self.post(key, data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        retry = self.post(key, data)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        # Another process only has the persisted record
+        local_cache().clear()
+        self.assertEqual(self.post(key, data).json(), first.json())
+        self.assertEqual(Activity.objects.filter(user_id='retry').count(), 1)
+    
+    def test_key_reused_for_another_request_is_rejected(self):
+        """Test that reusing a key with a different body answers 422"""
+        key = str(uuid.uuid4())
+        self.post(key, {'user_id': 'reuse', 'activity_type': 'Running', 'duration': 30})
+        response = self.post(key, {'user_id': 'reuse', 'activity_type': 'Running', 'duration': 45})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Activity.objects.filter(user_id='reuse').count(), 1)
+    
+    def test_msgpack_retry_is_replayed(self):
+        """Test that bodies whose parsed data is not JSON serializable are fingerprinted"""
+        key = str(uuid.uuid4())
+        body = MessagePackRenderer().render(
+            {'user_id': 'packed', 'activity_type': 'Running', 'duration': 30, 'ref': ObjectId()}
+        )
+        for _ in range(2):
+            response = self.client.post(
+                '/api/activities/', body, content_type='application/msgpack', HTTP_IDEMPOTENCY_KEY=key
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Activity.objects.filter(user_id='packed').count(), 1)
+    
+    def test_stale_claim_is_only_taken_over_by_the_same_request(self):
+        """Test that a different request cannot take over a claim whose owner died"""
+        get_db().idempotency_keys.insert_one({
+            '_id': 'stale', 'fingerprint': 'a', 'status': None, 'data': None,
+            'created_at': datetime.utcnow() - 2 * STALE_CLAIM,
+        })
+        self.assertEqual(claim('stale', 'b')['fingerprint'], 'a')
+        self.assertIsNone(claim('stale', 'a'))
+    
+    def test_response_cache_is_bounded_and_expires(self):
+        """Test that the in-memory cache evicts least recently used and expired keys"""
+        cache = ResponseCache(max_entries=2, ttl=60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        expired = ResponseCache(max_entries=2, ttl=-1)
+        expired.put('a', 1)
+        self.assertIsNone(expired.get('a'))
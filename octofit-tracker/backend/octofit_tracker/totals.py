@@ -0,0 +1,108 @@
+"""
+Denormalized ``total_points`` on users and teams.
+
+A user's total is the sum of their activities' points and a team's total is
+the sum of its members' totals. Both are kept current with atomic ``$inc``
+updates as activities and memberships change; ``reconcile`` recomputes them
+from the activities collection and fixes any drift.
+"""
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .mongo import get_db
+
+BATCH_SIZE = 1000
+
+
+def _user_object_ids(user_ids):
+    return [ObjectId(user_id) for user_id in user_ids if user_id and ObjectId.is_valid(user_id)]
+
+
+def record_points(changes, db=None):
+    """
+    Apply ``(user_id, points, created_at, sign, ...)`` activity changes to the
+    totals of the users and of every team they belong to.
+    """
+    deltas = {}
+    for user_id, points, _, sign, *_ in changes:
+        user_id = str(user_id)
+        deltas[user_id] = deltas.get(user_id, 0) + (points or 0) * sign
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    db = db if db is not None else get_db()
+    user_updates = [
+        UpdateOne({'_id': ObjectId(user_id)}, {'$inc': {'total_points': delta}})
+        for user_id, delta in deltas.items() if ObjectId.is_valid(user_id)
+    ]
+    if user_updates:
+        db.users.bulk_write(user_updates)
+
+    team_deltas = {}
+    for team in db.teams.find({'member_ids': {'$in': list(deltas)}}, {'member_ids': 1}):
+        team_deltas[team['_id']] = sum(
+            deltas.get(member_id, 0) for member_id in set(team.get('member_ids') or [])
+        )
+    team_updates = [
+        UpdateOne({'_id': team_id}, {'$inc': {'total_points': delta}})
+        for team_id, delta in team_deltas.items() if delta
+    ]
+    if team_updates:
+        db.teams.bulk_write(team_updates)
+
+
+def members_points(user_ids, db=None):
+    """Return the summed ``total_points`` of the given users"""
+    object_ids = _user_object_ids(user_ids)
+    if not object_ids:
+        return 0
+    db = db if db is not None else get_db()
+    result = list(db.users.aggregate([
+        {'$match': {'_id': {'$in': object_ids}}},
+        {'$group': {'_id': None, 'total': {'$sum': {'$ifNull': ['$total_points', 0]}}}},
+    ]))
+    return result[0]['total'] if result else 0
+
+
+def _fix(collection, expected, db, dry_run):
+    """Correct documents of ``collection`` whose total differs from ``expected``"""
+    drift = []
+    for document in db[collection].find({}, {'total_points': 1}, batch_size=BATCH_SIZE):
+        want = expected.get(document['_id'], 0)
+        have = document.get('total_points') or 0
+        if want != have:
+            # Only overwrite the value we read, so concurrent increments are kept
+            drift.append(UpdateOne(
+                {'_id': document['_id'], 'total_points': document.get('total_points')},
+                {'$set': {'total_points': want}},
+            ))
+    if not dry_run:
+        for start in range(0, len(drift), BATCH_SIZE):
+            db[collection].bulk_write(drift[start:start + BATCH_SIZE], ordered=False)
+    return len(drift)
+
+
+def reconcile(db=None, dry_run=False):
+    """
+    Recompute user and team totals from activities and fix drifted documents.
+
+    Returns the number of drifted ``(users, teams)``.
+    """
+    db = db if db is not None else get_db()
+    user_totals = {}
+    for row in db.activities.aggregate([
+        {'$group': {'_id': '$user_id', 'total': {'$sum': {'$ifNull': ['$points', 0]}}}},
+    ], allowDiskUse=True):
+        if row['_id'] and ObjectId.is_valid(row['_id']):
+            user_totals[ObjectId(row['_id'])] = row['total']
+
+    team_totals = {}
+    for team in db.teams.find({}, {'member_ids': 1}):
+        team_totals[team['_id']] = sum(
+            user_totals.get(ObjectId(member_id), 0)
+            for member_id in set(team.get('member_ids') or [])
+            if ObjectId.is_valid(member_id)
+        )
+
+    return _fix('users', user_totals, db, dry_run), _fix('teams', team_totals, db, dry_run)
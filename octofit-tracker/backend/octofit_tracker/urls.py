@@ -20,12 +20,16 @@ from rest_framework import routers
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from . import async_views
 from .views import (
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
     LeaderboardViewSet,
-    WorkoutViewSet
+    WorkoutViewSet,
+    response_cache_stats,
+    mongo_pool_stats,
+    request_metrics
 )
 
 # Determine base URL
@@ -63,5 +67,13 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root, name='api-root'),
     path('api/', api_root, name='api-root'),
+    path('api/cache-stats/', response_cache_stats, name='cache-stats'),
+    path('api/pool-stats/', mongo_pool_stats, name='pool-stats'),
+    path('api/metrics/', request_metrics, name='metrics'),
+    path('api/async/users/<str:pk>/', async_views.user_detail, name='async-user-detail'),
+    path('api/async/users/<str:pk>/activities/', async_views.user_activities, name='async-user-activities'),
+    path('api/async/users/<str:pk>/teams/', async_views.user_teams, name='async-user-teams'),
+    path('api/async/users/<str:pk>/dashboard/', async_views.user_dashboard, name='async-user-dashboard'),
+    path('api/async/leaderboard/', async_views.leaderboard, name='async-leaderboard'),
     path('api/', include(router.urls)),
 ]
@@ -1,94 +1,276 @@
+from datetime import datetime, time, timezone as dt_timezone
+
+from bson import ObjectId
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from pymongo import ReturnDocument
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
 from .models import User, Team, Activity, Leaderboard, Workout
 from .serializers import (
     UserSerializer, 
     TeamSerializer, 
+    TeamMembershipSerializer,
     ActivitySerializer, 
     LeaderboardSerializer, 
     WorkoutSerializer
 )
+from .activity_changes import activities_changed, activity_change
+from .fast_serializers import rows_for
+from .leaderboard import PERIODS, entry_rows, get_rankings, range_rankings, ranking_rows
+from .mongo import as_model, get_db, pool_metrics
+from .pagination import KeysetPagination
+from .workout_index import activity_mix, workout_catalog
+from .totals import members_points
+from . import export, repository, rollups, write_behind
+from .idempotency import idempotent
+from .ingest import MAX_BATCH_SIZE, activity_document, bulk_create_activities
+from .response_cache import bump_version, cache_stats, cached_response
+from .request_metrics import route_metrics
+
+
+def date_bounds(params):
+    """
+    Parse the optional ``start`` and ``end`` query parameters (ISO dates or
+    datetimes) into naive UTC datetimes; raises ValueError when malformed.
+    """
+    bounds = {}
+    for name in ('start', 'end'):
+        value = params.get(name)
+        if value is None:
+            continue
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(f'{name} must be an ISO date or datetime')
+            parsed = datetime.combine(day, time.min)
+        if timezone.is_aware(parsed):
+            parsed = timezone.make_naive(parsed, dt_timezone.utc)
+        bounds[name] = parsed
+    return bounds
+
+
+def limit_param(params):
+    """Parse the optional positive ``limit`` query parameter; raises ValueError"""
+    value = params.get('limit')
+    if value is None:
+        return None
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError('limit must be a positive integer')
+    return int(value)
+
+
+def stats_response(request, load):
+    """
+    Answer a stats action: validate ``bucket``, ``start`` and ``end`` and
+    return ``load(bucket, start, end)``, or 404 when it returns None.
+    """
+    bucket = request.query_params.get('bucket', 'day')
+    if bucket not in rollups.BUCKETS:
+        return Response(
+            {'error': f'bucket must be one of: {", ".join(rollups.BUCKETS)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        bounds = date_bounds(request.query_params)
+    except ValueError as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    rows = load(bucket, bounds.get('start'), bounds.get('end'))
+    if rows is None:
+        raise NotFound()
+    return Response(rows)
+
+
+class SparseFieldsViewSetMixin:
+    """
+    Load only the columns a serializer renders. Lists go through the
+    compiled rows of ``fast_serializers`` over ``values()`` dicts; single
+    objects load a sparse serializer's (``?fields=`` / ``?compact=1``)
+    columns with ``only()``. The pagination ordering fields the cursor is
+    built from are always loaded.
+    """
+    
+    def ordering_fields(self):
+        if self.paginator is None:
+            return set()
+        return {field.lstrip('-') for field in getattr(self.paginator, 'ordering', ())}
+    
+    def project(self, queryset, serializer):
+        fields = serializer.projection()
+        if fields is None or self.request.method not in SAFE_METHODS:
+            return queryset
+        return queryset.only(*fields | self.ordering_fields())
+    
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'retrieve':
+            queryset = self.project(queryset, self.get_serializer())
+        return queryset
+    
+    def list_query(self):
+        """The queryset, or a ``repository`` query, that ``list`` renders"""
+        return self.filter_queryset(self.get_queryset())
+    
+    def list(self, request, *args, **kwargs):
+        return self.fast_response(self.list_query(), self.get_serializer())
+    
+    def fast_response(self, queryset, serializer):
+        """
+        Render ``queryset`` (or a ``repository.MongoQuery``) with the compiled
+        rows of ``serializer``, paginated like ``list``
+        """
+        rows = rows_for(serializer)
+        queryset = queryset.values(*rows.columns | self.ordering_fields())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(rows.render(page))
+        return Response(rows.render(queryset))
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing User instances.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = KeysetPagination
     
     @action(detail=True, methods=['get'])
     def activities(self, request, pk=None):
         """Get all activities for a specific user"""
         user = self.get_object()
         user_id = str(user._id)
-        activities = Activity.objects.filter(user_id=user_id)
-        serializer = ActivitySerializer(activities, many=True)
-        return Response(serializer.data)
+        return self.fast_response(
+            repository.activities_by_user(user_id),
+            ActivitySerializer(context=self.get_serializer_context()),
+        )
     
     @action(detail=True, methods=['get'])
     def teams(self, request, pk=None):
         """Get all teams for a specific user"""
         user = self.get_object()
         user_id = str(user._id)
-        teams = Team.objects.filter(member_ids__contains=user_id)
-        serializer = TeamSerializer(teams, many=True)
-        return Response(serializer.data)
+        rows = rows_for(TeamSerializer(context=self.get_serializer_context()))
+        return Response(rows.render(repository.teams_by_member(user_id).values(*rows.columns)))
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """
+        Duration, distance, calories and points of the user's activities per
+        ``?bucket=day|week|month``, optionally within ``start`` and ``end``
+        """
+        user = self.get_object()
+        return stats_response(
+            request, lambda bucket, start, end: rollups.user_stats(user._id, bucket, start, end)
+        )
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(SparseFieldsViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Team instances.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    # Attempts of a membership change racing other changes of the same team
+    membership_retries = 25
+    
+    def perform_create(self, serializer):
+        team = serializer.save()
+        self._add_points(team, members_points(set(team.member_ids or [])))
+    
+    def perform_update(self, serializer):
+        before = set(serializer.instance.member_ids or [])
+        team = serializer.save()
+        after = set(team.member_ids or [])
+        self._add_points(team, members_points(after - before) - members_points(before - after))
+    
+    def _add_points(self, team, delta):
+        """Apply a membership change's points to the stored and rendered team total"""
+        if delta:
+            get_db().teams.update_one({'_id': team._id}, {'$inc': {'total_points': delta}})
+            team.total_points = (team.total_points or 0) + delta
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """
+        Activity totals of the team's current members per
+        ``?bucket=day|week|month``, optionally within ``start`` and ``end``
+        """
+        return stats_response(
+            request, lambda bucket, start, end: rollups.team_stats(pk, bucket, start, end)
+        )
     
     @action(detail=True, methods=['post'])
     def add_member(self, request, pk=None):
-        """Add a member to the team"""
-        team = self.get_object()
-        user_id = request.data.get('user_id')
-        
-        if not user_id:
-            return Response(
-                {'error': 'user_id is required'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if user_id not in team.member_ids:
-            team.member_ids.append(user_id)
-            team.save()
-        
-        serializer = self.get_serializer(team)
-        return Response(serializer.data)
+        """Add a member (``user_id``) or many members (``user_ids``) to the team"""
+        return self._update_members(request, pk, '$addToSet', lambda ids: {'$each': ids})
     
     @action(detail=True, methods=['post'])
     def remove_member(self, request, pk=None):
-        """Remove a member from the team"""
-        team = self.get_object()
-        user_id = request.data.get('user_id')
+        """Remove a member (``user_id``) or many members (``user_ids``) from the team"""
+        return self._update_members(request, pk, '$pull', lambda ids: {'$in': ids})
+    
+    def _update_members(self, request, pk, operator, values):
+        """
+        Change ``member_ids`` and the team's ``total_points`` in one atomic
+        update and return the updated team.
+
+        The update only applies if the member list is still the one the
+        points delta was computed from; otherwise it is recomputed and
+        retried, so concurrent membership changes are never lost or
+        counted twice.
+        """
+        membership = TeamMembershipSerializer(data=request.data)
+        if not membership.is_valid():
+            return Response(membership.errors, status=status.HTTP_400_BAD_REQUEST)
+        user_ids = membership.validated_data['user_ids']
+        if not ObjectId.is_valid(pk):
+            raise NotFound()
         
-        if not user_id:
-            return Response(
-                {'error': 'user_id is required'}, 
-                status=status.HTTP_400_BAD_REQUEST
+        db = get_db()
+        for _ in range(self.membership_retries):
+            team = db.teams.find_one({'_id': ObjectId(pk)}, {'member_ids': 1})
+            if team is None:
+                raise NotFound()
+            before = team.get('member_ids') or []
+            if operator == '$addToSet':
+                changed = [user_id for user_id in user_ids if user_id not in before]
+                after = before + changed
+                sign = 1
+            else:
+                changed = [user_id for user_id in user_ids if user_id in before]
+                after = [user_id for user_id in before if user_id not in changed]
+                sign = -1
+            update = {'$set': {'member_ids': after}, '$currentDate': {'updated_at': True}}
+            delta = sign * members_points(changed, db)
+            if delta:
+                update['$inc'] = {'total_points': delta}
+            team = db.teams.find_one_and_update(
+                {'_id': team['_id'], 'member_ids': team.get('member_ids')},
+                update,
+                return_document=ReturnDocument.AFTER,
             )
-        
-        if user_id in team.member_ids:
-            team.member_ids.remove(user_id)
-            team.save()
-        
-        serializer = self.get_serializer(team)
-        return Response(serializer.data)
+            if team is not None:
+                serializer = self.get_serializer(as_model(Team, team))
+                return Response(serializer.data)
+        return Response(
+            {'error': 'The team is being changed concurrently; try again'},
+            status=status.HTTP_409_CONFLICT
+        )
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(SparseFieldsViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Activity instances.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         """
@@ -99,9 +281,112 @@ class ActivityViewSet(viewsets.ModelViewSet):
         if user_id is not None:
             queryset = queryset.filter(user_id=user_id)
         return queryset
+    
+    def list_query(self):
+        user_id = self.request.query_params.get('user_id', None)
+        if user_id is not None:
+            return repository.activities_by_user(user_id)
+        return super().list_query()
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream activities as NDJSON (default) or CSV, chosen with ``?output=``.
+        Filter with ``user_id``, ``start`` and ``end`` (ISO dates or datetimes;
+        ``end`` is exclusive).
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in export.FORMATS:
+            return Response(
+                {'error': f'output must be one of: {", ".join(export.FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            bounds = date_bounds(request.query_params)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        rows = export.activity_rows(
+            user_id=request.query_params.get('user_id'),
+            start=bounds.get('start'),
+            end=bounds.get('end'),
+        )
+        encode, content_type = export.FORMATS[output]
+        response = StreamingHttpResponse(encode(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="activities.{output}"'
+        return response
+    
+    @action(detail=False, methods=['post'])
+    @idempotent
+    def bulk(self, request):
+        """
+        Create many activities from a JSON array in one batched write.
+        Each item gets its own result, so invalid items do not fail the batch.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {'error': 'Expected a list of activities'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > MAX_BATCH_SIZE:
+            return Response(
+                {'error': f'At most {MAX_BATCH_SIZE} activities per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = bulk_create_activities(items)
+        created = sum(1 for result in results if 'id' in result)
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'results': results}, status=response_status)
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """
+        Retries carrying the same ``Idempotency-Key`` get the first response.
+        With write-behind ingestion on, answer 202 Accepted once the
+        activity is in the local log; it is inserted with the next batch.
+        """
+        buffer = write_behind.get_buffer()
+        if buffer is None:
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Stored as naive UTC, like djongo does for DateTimeFields
+        document = activity_document(serializer.validated_data, datetime.utcnow())
+        if not buffer.append(document):
+            # Too many activities are waiting for MongoDB; write through
+            self.perform_create(serializer)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        serializer = self.get_serializer(as_model(Activity, document))
+        # Looking the name up would make the acknowledgement wait on MongoDB
+        serializer.fields.pop('user_name', None)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+    
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        activities_changed([activity_change(activity, 1)])
+    
+    def perform_update(self, serializer):
+        previous = activity_change(serializer.instance, -1)
+        activity = serializer.save()
+        current = activity_change(activity, 1)
+        if previous._replace(sign=1) != current:
+            activities_changed([previous, current])
+    
+    def perform_destroy(self, instance):
+        previous = activity_change(instance, -1)
+        instance.delete()
+        activities_changed([previous])
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(SparseFieldsViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Leaderboard instances.
     """
@@ -111,36 +396,39 @@ class LeaderboardViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         """
         Return user rankings in a format suitable for the frontend.
-        For now, aggregate all user activities to create a leaderboard.
+        Rankings are read from the materialized leaderboard for the current
+        ``period`` (weekly, monthly or all-time; default all-time), or
+        computed from the daily rollups for ``period=custom`` (implied by
+        ``start``/``end``). ``limit`` returns only the top entries.
         """
-        from django.db.models import Sum, Count
-        
-        # Aggregate activities by user to create leaderboard
-        # This is a temporary solution until proper leaderboard data is populated
-        leaderboard_data = []
-        
-        # Get all users with their activities
-        users = User.objects.all()
-        for user in users:
-            user_id = str(user._id)
-            activities = Activity.objects.filter(user_id=user_id)
-            
-            total_activities = activities.count()
-            total_points = sum(a.points for a in activities if a.points) or 0
-            
-            if total_activities > 0 or total_points > 0:
-                leaderboard_data.append({
-                    'id': user_id,
-                    'user': str(user._id),
-                    'user_name': user.username or user.email or 'Unknown User',
-                    'total_points': total_points,
-                    'total_activities': total_activities
-                })
-        
-        # Sort by total_points descending
-        leaderboard_data.sort(key=lambda x: x['total_points'], reverse=True)
-        
-        return Response(leaderboard_data)
+        try:
+            limit = limit_param(request.query_params)
+            bounds = date_bounds(request.query_params)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        period = request.query_params.get('period', 'custom' if bounds else 'all-time')
+        if period == 'custom':
+            rankings = range_rankings(bounds.get('start'), bounds.get('end'), limit)
+            return Response(entry_rows(rankings))
+        if period not in PERIODS:
+            return Response(
+                {'error': f'period must be one of: {", ".join(PERIODS + ("custom",))}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(ranking_rows(get_rankings(period, limit=limit)))
+    
+    @action(detail=False, methods=['get'])
+    def teams(self, request):
+        """Rank teams by their precomputed total_points, optionally the top ``limit``"""
+        try:
+            limit = limit_param(request.query_params)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        rows = rows_for(TeamSerializer(context=self.get_serializer_context()))
+        teams = Team.objects.order_by('-total_points').values(*rows.columns)
+        if limit:
+            teams = teams[:limit]
+        return Response(rows.render(teams))
     
     def get_queryset(self):
         """
@@ -153,7 +441,7 @@ class LeaderboardViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(SparseFieldsViewSetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Workout instances.
     """
@@ -170,12 +458,65 @@ class WorkoutViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(difficulty_level=difficulty)
         return queryset
     
+    def list_query(self):
+        difficulty = self.request.query_params.get('difficulty_level', None)
+        if difficulty is not None:
+            return repository.workouts_by_level(difficulty)
+        return super().list_query()
+    
+    @cached_response('workouts')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        bump_version('workouts')
+    
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        bump_version('workouts')
+    
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        bump_version('workouts')
+    
     @action(detail=False, methods=['get'])
+    @cached_response('workouts', 'activities')
     def recommended(self, request):
-        """Get recommended workouts based on fitness level"""
+        """
+        Get recommended workouts for ``fitness_level`` (optionally one
+        ``difficulty_level``) from the in-memory workout index, ranked by the
+        recent activity mix of ``user_id`` when given
+        """
         fitness_level = request.query_params.get('fitness_level', 'beginner')
-        workouts = Workout.objects.filter(
-            target_fitness_levels__contains=fitness_level
+        user_id = request.query_params.get('user_id')
+        mix = activity_mix(user_id) if user_id else None
+        workouts = workout_catalog.index().recommend(
+            fitness_level, request.query_params.get('difficulty_level'), mix
         )
         serializer = self.get_serializer(workouts, many=True)
         return Response(serializer.data)
+
+
+@api_view(['GET'])
+def response_cache_stats(request, format=None):
+    """
+    Hit, miss and 304 counts of the response cache in this process
+    """
+    return Response(cache_stats())
+
+
+@api_view(['GET'])
+def mongo_pool_stats(request, format=None):
+    """
+    Connection pool usage and checkout wait times of this process's MongoClient
+    """
+    return Response(pool_metrics.snapshot())
+
+
+@api_view(['GET'])
+def request_metrics(request, format=None):
+    """
+    Per-route histograms of request time, MongoDB time and commands per request
+    """
+    return Response(route_metrics.snapshot())
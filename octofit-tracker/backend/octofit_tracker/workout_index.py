@@ -0,0 +1,154 @@
+"""
+Process-local inverted index over the workout catalog.
+
+The catalog is small and read constantly, so each process keeps every
+workout in memory, indexed by target fitness level, difficulty and the
+words of its title, description and exercise names. The index is built on
+first use and rebuilt whenever the ``workouts`` version counter of the
+response cache changes (every workout write bumps it), so recommendations
+are answered without querying the workouts collection. The counter misses
+writes from other processes and from outside the viewsets, so every
+``CHECK_INTERVAL`` seconds a cheap aggregate compares the collection's
+size, newest id and latest ``updated_at`` with the indexed snapshot and
+rebuilds it when they differ.
+
+Recommendations are ranked by how well a workout's words match the kinds
+of activity the user logged recently.
+"""
+from collections import Counter
+import re
+import threading
+import time
+
+from .indexes import NEWEST_FIRST
+from .models import Workout
+from .mongo import as_model, get_db
+from .response_cache import collection_version
+
+# Recent activities that make up a user's activity mix
+RECENT_ACTIVITIES = 50
+
+# Seconds between checks of the catalog against MongoDB
+CHECK_INTERVAL = 10
+
+# Workout words that suit each activity type, besides the type's own words
+ACTIVITY_TERMS = {
+    'running': ('run', 'sprint', 'speed', 'cardio'),
+    'cycling': ('cycling', 'endurance', 'cardio'),
+    'swimming': ('swim', 'swimming', 'freestyle', 'laps'),
+    'walking': ('walk', 'endurance'),
+    'weight training': ('strength', 'curls', 'press', 'squats', 'deadlifts'),
+    'yoga': ('yoga', 'flexibility', 'stretching', 'pilates'),
+    'boxing': ('boxing', 'combat', 'hiit'),
+}
+
+
+def words(text):
+    return set(re.findall(r'[a-z]+', (text or '').lower()))
+
+
+def activity_terms(activity_type):
+    """Words a workout should contain to suit ``activity_type``"""
+    activity_type = (activity_type or '').lower()
+    return words(activity_type) | set(ACTIVITY_TERMS.get(activity_type, ()))
+
+
+class WorkoutIndex:
+    """Immutable snapshot of the catalog with its inverted indexes"""
+
+    def __init__(self, documents):
+        # Positions in this list are the postings of every index
+        self.workouts = [as_model(Workout, document) for document in documents]
+        self.by_level = {}
+        self.by_difficulty = {}
+        self.by_word = {}
+        for position, workout in enumerate(self.workouts):
+            for level in workout.target_fitness_levels or []:
+                self.by_level.setdefault(level, set()).add(position)
+            self.by_difficulty.setdefault(workout.difficulty_level, set()).add(position)
+            text = words(workout.title) | words(workout.description)
+            for exercise in workout.exercises or []:
+                if isinstance(exercise, dict):
+                    text |= words(exercise.get('name'))
+            for word in text:
+                self.by_word.setdefault(word, set()).add(position)
+
+    def recommend(self, fitness_level, difficulty=None, mix=None):
+        """
+        Workouts targeting ``fitness_level`` (and ``difficulty``, if given),
+        best match for the ``{activity_type: share}`` mix first, catalog
+        order otherwise.
+        """
+        candidates = self.by_level.get(fitness_level, set())
+        if difficulty is not None:
+            candidates = candidates & self.by_difficulty.get(difficulty, set())
+        scores = dict.fromkeys(candidates, 0.0)
+        for activity_type, share in (mix or {}).items():
+            matches = set()
+            for term in activity_terms(activity_type):
+                matches |= self.by_word.get(term, set())
+            for position in matches & candidates:
+                scores[position] += share
+        ranked = sorted(candidates, key=lambda position: (-scores[position], position))
+        return [self.workouts[position] for position in ranked]
+
+
+def catalog_signature(db):
+    """Size, newest ``_id`` and latest ``updated_at`` of the workouts collection"""
+    rows = list(db.workouts.aggregate([{'$group': {
+        '_id': None,
+        'count': {'$sum': 1},
+        'newest': {'$max': '$_id'},
+        'updated': {'$max': '$updated_at'},
+    }}]))
+    return (rows[0]['count'], rows[0]['newest'], rows[0]['updated']) if rows else (0, None, None)
+
+
+class WorkoutCatalog:
+    """Hands out the current ``WorkoutIndex``, rebuilding it after writes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+        self._signature = None
+        self._checked = 0.0
+
+    def index(self, db=None):
+        version = collection_version('workouts')
+        stale = self._index is None or self._version != version
+        if stale or time.monotonic() - self._checked >= CHECK_INTERVAL:
+            with self._lock:
+                db = db if db is not None else get_db()
+                if self._index is None or self._version != version:
+                    self._rebuild(version, db)
+                elif time.monotonic() - self._checked >= CHECK_INTERVAL:
+                    self._checked = time.monotonic()
+                    if catalog_signature(db) != self._signature:
+                        self._rebuild(version, db)
+        return self._index
+
+    def _rebuild(self, version, db):
+        # Read after the version, so a concurrent write forces another rebuild
+        self._signature = catalog_signature(db)
+        self._index = WorkoutIndex(db.workouts.find().sort('_id', 1))
+        self._version = version
+        self._checked = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+
+workout_catalog = WorkoutCatalog()
+
+
+def activity_mix(user_id, db=None, limit=RECENT_ACTIVITIES):
+    """Share of each activity type among the user's ``limit`` latest activities"""
+    db = db if db is not None else get_db()
+    recent = db.activities.find(
+        {'user_id': user_id}, {'activity_type': 1}
+    ).sort(NEWEST_FIRST).limit(limit)
+    counts = Counter((activity.get('activity_type') or '').lower() for activity in recent)
+    total = sum(counts.values())
+    return {activity_type: count / total for activity_type, count in counts.items()}
@@ -0,0 +1,338 @@
+"""
+Write-behind ingestion for single activity POSTs.
+
+With ``settings.WRITE_BEHIND['ENABLED']``, ``ActivityViewSet.create``
+acknowledges a new activity once it is in a local append-only log instead
+of after the MongoDB insert. ``WriteBehindBuffer`` gives the document its
+``_id`` up front and appends it, BSON encoded, to the current log segment
+and, unless ``FSYNC`` is off, waits for an fsync of the segment. The fsync
+runs outside the buffer's lock and covers every append made before it, so
+concurrent requests share one. A background thread writes each segment
+with one ``insert_many`` once ``MAX_BATCH`` activities are waiting or
+``FLUSH_INTERVAL`` seconds have passed, updates the derived data and
+deletes the segment.
+
+Every process writes its own segments and holds an ``flock`` on them for
+as long as they are open. ``replay`` inserts the activities of segments no
+live process holds, which is what a crashed process leaves behind; the
+ids are fixed, so activities that reached MongoDB before the crash are
+skipped as duplicates. Activities MongoDB rejects outright (a failed
+validation, say) are moved to ``dead-letter.bson`` in the log directory
+and logged, so they cannot hold back the segments after them. A crash
+between an insert and the update of the leaderboards, totals and rollups
+is repaired by ``rebuild_leaderboards``, ``reconcile_totals`` and
+``rebuild_rollups``.
+"""
+import atexit
+from collections import deque
+import fcntl
+import itertools
+import logging
+import os
+from pathlib import Path
+import threading
+
+import bson
+from bson import ObjectId
+from bson.errors import InvalidBSON
+from django.conf import settings
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from .activity_changes import ActivityChange, activities_changed
+from .mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+# Activities MongoDB refused to insert, BSON encoded like the segments
+DEAD_LETTER = 'dead-letter.bson'
+
+
+class Segment:
+    """One log file, locked by the process appending to it"""
+
+    def __init__(self, log_dir, name):
+        path = log_dir / f'{name}.log'
+        # Lock before the file gets the name replay looks for
+        partial = log_dir / f'{name}.new'
+        self.file = open(partial, 'ab')
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(partial, path)
+        self.path = path
+        self.documents = []
+        self.synced = 0
+        self._sync = threading.Condition()
+        self._syncing = False
+        self._removed = False
+
+    def append(self, document):
+        """Write ``document``; returns the count to pass to ``sync``"""
+        self.file.write(bson.encode(document))
+        self.file.flush()
+        self.documents.append(document)
+        return len(self.documents)
+
+    def sync(self, count):
+        """
+        Return once the first ``count`` documents are on disk. One caller
+        fsyncs everything written so far while the others wait for it, so
+        concurrent appends share an fsync (group commit).
+        """
+        with self._sync:
+            while self.synced < count and not self._removed:
+                if self._syncing:
+                    self._sync.wait()
+                    continue
+                self._syncing = True
+                written = len(self.documents)
+                self._sync.release()
+                try:
+                    os.fsync(self.file.fileno())
+                    self.synced = written
+                finally:
+                    self._sync.acquire()
+                    self._syncing = False
+                    self._sync.notify_all()
+
+    def remove(self):
+        """Delete the segment once its documents are stored in MongoDB"""
+        with self._sync:
+            while self._syncing:
+                self._sync.wait()
+            # Stored documents need no fsync; waiting writers can return
+            self._removed = True
+            self._sync.notify_all()
+        self.path.unlink()
+        self.file.close()
+
+
+def read_segment(file):
+    """The documents of a segment, up to a write torn by a crash"""
+    documents = []
+    try:
+        for document in bson.decode_file_iter(file):
+            documents.append(document)
+    except InvalidBSON:
+        # The torn tail was never acknowledged
+        pass
+    return documents
+
+
+def dead_letter(log_dir, documents):
+    """Append activities MongoDB rejected to the dead-letter file of ``log_dir``"""
+    with open(Path(log_dir) / DEAD_LETTER, 'ab') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        for document in documents:
+            file.write(bson.encode(document))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def store(documents, db, log_dir):
+    """
+    Insert activity ``documents`` that are not stored yet and update the
+    data derived from them; returns how many were inserted. Documents
+    MongoDB rejects for any reason but a duplicate ``_id`` would fail on
+    every retry, so they are moved to the dead-letter file of ``log_dir``.
+    """
+    skipped = set()
+    try:
+        db.activities.insert_many(documents, ordered=False)
+    except BulkWriteError as error:
+        write_errors = error.details.get('writeErrors', [])
+        skipped = {write_error['index'] for write_error in write_errors}
+        rejected = [write_error for write_error in write_errors if write_error['code'] != DUPLICATE_KEY]
+        if rejected:
+            dead_letter(log_dir, [documents[write_error['index']] for write_error in rejected])
+            for write_error in rejected:
+                logger.error(
+                    'MongoDB rejected buffered activity %s (%s); moved it to %s',
+                    documents[write_error['index']]['_id'], write_error['errmsg'], DEAD_LETTER,
+                )
+    inserted = [document for index, document in enumerate(documents) if index not in skipped]
+    activities_changed([
+        ActivityChange(
+            document['user_id'], document['points'], document['created_at'], 1,
+            document['duration'], document['distance'], document['calories'],
+        )
+        for document in inserted
+    ], db=db)
+    return len(inserted)
+
+
+def replay(log_dir, db=None):
+    """
+    Store the activities of every segment in ``log_dir`` that no live
+    process holds and delete those segments; returns how many were new.
+    """
+    inserted = 0
+    for path in sorted(Path(log_dir).glob('*.log')):
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            continue
+        with file:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            documents = read_segment(file)
+            if documents:
+                db = db if db is not None else get_db()
+                inserted += store(documents, db, log_dir)
+            path.unlink(missing_ok=True)
+    return inserted
+
+
+class WriteBehindBuffer:
+    """Durably logged activities waiting for a batched insert"""
+
+    def __init__(self, log_dir, max_batch=500, flush_interval=0.2, fsync=True,
+                 max_pending=50000, db=None):
+        self.log_dir = Path(log_dir)
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_pending = max_pending
+        self.db = db
+        self.pending = 0
+        self._names = (f'{os.getpid()}-{id(self):x}-{seq:08d}' for seq in itertools.count())
+        self._current = None
+        self._segments = deque()
+        self._wake = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._stopping = False
+        self._replayed = False
+        self._thread = None
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+
+    def start(self):
+        """Replay what a crashed process left behind and start the flush thread"""
+        self._replay()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        return self
+
+    def append(self, document):
+        """
+        Log ``document``, giving it an ``_id`` if it has none, and queue it
+        for insertion. Returns False without logging it when ``max_pending``
+        activities are already waiting.
+        """
+        document.setdefault('_id', ObjectId())
+        with self._wake:
+            if self.pending >= self.max_pending:
+                return False
+            if self._current is None:
+                self._current = Segment(self.log_dir, next(self._names))
+            segment = self._current
+            count = segment.append(document)
+            self.pending += 1
+            if count >= self.max_batch:
+                self._wake.notify()
+        if self.fsync:
+            segment.sync(count)
+        return True
+
+    def flush(self):
+        """Insert everything appended so far before returning"""
+        with self._wake:
+            self._rotate()
+        return self._write_segments()
+
+    def stop(self, timeout=10):
+        """Flush what is left and stop the flush thread"""
+        with self._wake:
+            self._stopping = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        else:
+            self.flush()
+
+    def _rotate(self):
+        if self._current is not None:
+            self._segments.append(self._current)
+            self._current = None
+
+    def _run(self):
+        while True:
+            with self._wake:
+                full = self._current is not None and len(self._current.documents) >= self.max_batch
+                if not full and not self._stopping:
+                    self._wake.wait(self.flush_interval)
+                self._rotate()
+                stopping = self._stopping
+            self._replay()
+            self._write_segments()
+            if stopping:
+                # Segments MongoDB could not be reached for stay in the log for the next start
+                return
+
+    def _replay(self):
+        if self._replayed:
+            return
+        try:
+            replayed = replay(self.log_dir, self._get_db())
+        except PyMongoError:
+            logger.exception('Replaying the write-behind log failed; retrying later')
+            return
+        self._replayed = True
+        if replayed:
+            logger.warning('Replayed %d activities from the write-behind log', replayed)
+
+    def _write_segments(self):
+        """Write rotated segments in order; False when MongoDB failed"""
+        with self._write_lock:
+            while self._segments:
+                segment = self._segments[0]
+                try:
+                    store(segment.documents, self._get_db(), self.log_dir)
+                except PyMongoError:
+                    # The segment stays in the log and is retried on the next flush
+                    logger.exception('Writing %d buffered activities failed', len(segment.documents))
+                    return False
+                self._segments.popleft()
+                segment.remove()
+                with self._wake:
+                    self.pending -= len(segment.documents)
+        return True
+
+    def _get_db(self):
+        return self.db if self.db is not None else get_db()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """The process's running ``WriteBehindBuffer``, or None when write-behind is off"""
+    global _buffer
+    config = settings.WRITE_BEHIND
+    if not config['ENABLED']:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer(
+                    config['LOG_DIR'],
+                    max_batch=config['MAX_BATCH'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    fsync=config['FSYNC'],
+                    max_pending=config['MAX_PENDING'],
+                ).start()
+    return _buffer
+
+
+def stop_buffer():
+    """Flush and stop the process's buffer, if one is running"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is not None:
+            _buffer.stop()
+            _buffer = None
+
+
+atexit.register(stop_buffer)
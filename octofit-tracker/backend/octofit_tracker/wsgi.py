@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_wsgi_application()
+
+# Replay activities a crashed process left in the write-behind log
+from octofit_tracker.write_behind import get_buffer  # noqa: E402
+
+get_buffer()